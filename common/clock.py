@@ -0,0 +1,147 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Clock skew correction of the worker timestamps. Workers run on many hosts
+whose clocks differ from the client's, so their timestamps are moved to
+the client clock before being compared with it or with each other.
+
+A worker ran between the host-side submission of its call and the moment
+the host saw it done, so its offset (added to its timestamps) is bounded:
+
+    host_submit_tstamp - worker_start_tstamp
+        <= offset <=
+    host_status_done_tstamp - worker_end_tstamp
+
+The workers of a run usually share the same skew, so the offset of the
+run is the smallest correction within the bounds of all its workers (0 if
+their timestamps are already consistent). Each worker then gets the
+closest offset to it within its own bounds. Corrected timestamps are
+stored next to the raw ones, with a '_corrected' suffix.
+"""
+
+import numpy as np
+
+# host-side worker_stats keys bounding the offset
+BOUND_KEYS = ['host_submit_tstamp', 'host_status_done_tstamp']
+# worker_stats and results keys taken with the worker clock
+STATS_KEYS = ['worker_start_tstamp', 'worker_end_tstamp', 'worker_func_start_tstamp', 'worker_func_end_tstamp']
+RESULT_KEYS = ['start_time', 'end_time']
+SUFFIX = '_corrected'
+
+
+def stats_columns(worker_stats):
+    """
+    Float columns of the host and worker timestamps of a list of
+    worker_stats dicts, NaN where a worker does not have them
+    """
+    return {key: np.array([s.get(key, np.nan) for s in worker_stats], dtype=np.float64)
+            for key in BOUND_KEYS + STATS_KEYS}
+
+
+def clock_offsets(columns):
+    """
+    Seconds to add to the timestamps of every worker to move them to the
+    client clock, NaN for the workers whose offset cannot be estimated.
+    columns holds the worker_stats timestamps, one array per key.
+    """
+    rows = len(columns['worker_start_tstamp'])
+    offsets = np.full(rows, np.nan)
+    if 'host_submit_tstamp' not in columns or 'host_status_done_tstamp' not in columns:
+        return offsets
+    lower = columns['host_submit_tstamp'] - columns['worker_start_tstamp']
+    upper = columns['host_status_done_tstamp'] - columns['worker_end_tstamp']
+    known = ~np.isnan(lower) & ~np.isnan(upper)
+    if not known.any():
+        return offsets
+
+    lower, upper = lower[known], upper[known]
+    valid = lower <= upper
+    if lower.max() <= upper.min():
+        run_offset = np.clip(0.0, lower.max(), upper.min())
+    elif valid.any():
+        run_offset = np.median(np.clip(0.0, lower[valid], upper[valid]))
+    else:
+        run_offset = 0.0
+
+    # bounds that cross each other come from timestamps taken too coarsely
+    offsets[known] = np.where(valid, np.clip(run_offset, lower, np.maximum(lower, upper)), (lower + upper) / 2)
+    return offsets
+
+
+def correct_clocks(res):
+    """
+    Adds the clock_offset and the corrected timestamps to the worker_stats
+    and results dicts of a run. Returns the offsets, None if they cannot
+    be estimated.
+    """
+    offsets = clock_offsets(stats_columns(res['worker_stats']))
+    if np.isnan(offsets).all():
+        return None
+    offsets = np.nan_to_num(offsets)
+    for stats, offset in zip(res['worker_stats'], offsets.tolist()):
+        stats['clock_offset'] = offset
+        stats.update({key + SUFFIX: stats[key] + offset for key in STATS_KEYS if key in stats})
+    for result, offset in zip(res['results'], offsets.tolist()):
+        if isinstance(result, dict):
+            result.update({key + SUFFIX: result[key] + offset for key in RESULT_KEYS if key in result})
+    return offsets
+
+
+def correct_stored_clocks(store):
+    """
+    Adds the clock_offset and the corrected timestamps as columns of the
+    worker_stats and results tables of a ResultStore, replacing those of
+    a previous correction. Returns the offsets, None if they cannot be
+    estimated.
+    """
+    if 'worker_stats' not in store.tables:
+        return None
+    store.compact()
+    stats = store.load('worker_stats', [k for k in ['worker'] + BOUND_KEYS + STATS_KEYS
+                                        if k in store.columns('worker_stats')], mmap=False)
+    if 'worker_start_tstamp' not in stats:
+        return None
+    offsets = clock_offsets(stats)
+    if np.isnan(offsets).all():
+        return None
+    offsets = np.nan_to_num(offsets)
+
+    columns = {'clock_offset': offsets}
+    columns.update({key + SUFFIX: stats[key] + offsets for key in STATS_KEYS if key in stats})
+    store.add_columns('worker_stats', columns)
+
+    if 'results' in store.tables:
+        keys = [k for k in RESULT_KEYS if k in store.columns('results')]
+        results = store.load('results', ['worker'] + keys, mmap=False)
+        worker_offsets = dict(zip(stats['worker'].tolist(), offsets.tolist()))
+        result_offsets = np.array([worker_offsets.get(w, 0.0) for w in results['worker'].tolist()])
+        store.add_columns('results', {key + SUFFIX: results[key] + result_offsets for key in keys})
+    return offsets
+
+
+def print_offsets(offsets):
+    if offsets is not None and np.any(offsets):
+        print('Clock skew corrected - worker offsets median {:.1f} ms, max {:.1f} ms'.format(
+            np.median(offsets) * 1000, np.abs(offsets).max() * 1000))
+
+
+def corrected(record, key):
+    """
+    Timestamp of a worker on the client clock if it was corrected, else
+    the raw one
+    """
+    return record.get(key + SUFFIX, record[key])
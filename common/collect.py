@@ -0,0 +1,147 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import numpy as np
+
+from lithops.wait import ANY_COMPLETED
+
+from common.store import ResultStore, MANIFEST, to_json
+from common.pricing import executor_backends
+from common.clock import correct_clocks, correct_stored_clocks, print_offsets
+from common.startup import print_startup
+
+
+class RunCollector(object):
+    """
+    Collects the results of a map as the workers finish, appending each
+    batch to a columnar run on disk (if path is given) and printing the
+    progress. With resume=True an existing run at path is reopened: its
+    meta is available in self.meta and only the workers missing from it
+    are executed again. The worker timestamps are corrected for clock
+    skew once all the workers are collected (see common.clock).
+    """
+
+    def __init__(self, path=None, resume=False):
+        self.store = None
+        self.meta = {}
+        self.completed = set()
+
+        if path is None:
+            return
+        if resume and os.path.exists(os.path.join(path, MANIFEST)):
+            self.store = ResultStore(path, 'a')
+            self.meta = dict(self.store.meta)
+            if 'results' in self.store.tables:
+                self.completed = set(self.store.load('results', ['worker'])['worker'].tolist())
+            print('Resuming {}: {} workers already completed'.format(path, len(self.completed)))
+        else:
+            self.store = ResultStore(path, 'w')
+
+    def run_params(self, params):
+        """
+        Returns the parameters of the run. Those saved in the meta of a
+        resumed run take precedence over the given ones, so that all its
+        workers run with the same settings.
+        """
+        resumed = {}
+        for name, value in params.items():
+            if name not in self.meta:
+                resumed[name] = value
+                continue
+            resumed[name] = self.meta[name]
+            if value is not None and to_json(value) != self.meta[name]:
+                print('Resuming with the saved {} {} instead of {}'.format(name, self.meta[name], value))
+        return resumed
+
+    def map(self, exc, func, iterdata, meta=None, quantity=None, unit='MB/s'):
+        """
+        Runs func over the items of iterdata not completed yet and returns
+        the run dict. quantity(result) gives the amount of work done by a
+        worker (MB, FLOPs...) used to print the running aggregate rate.
+        The compute and storage backends of exc are added to the meta.
+        """
+        pending_ids = [i for i in range(len(iterdata)) if i not in self.completed]
+        meta = dict(meta or {}, **executor_backends(exc))
+        if self.store is not None:
+            self.store.update_meta(meta)
+
+        worker_stats = {}
+        results = {}
+        failed = 0
+        done_work = 0
+        start_time = time.time()
+
+        if pending_ids:
+            futures = exc.map(func, [iterdata[i] for i in pending_ids])
+            worker_ids = {id(f): i for f, i in zip(futures, pending_ids)}
+            not_done = futures
+            while not_done:
+                done, not_done = exc.wait(not_done, return_when=ANY_COMPLETED,
+                                          download_results=True, throw_except=False)
+                batch_ids, batch_stats, batch_results = [], [], []
+                for f in done:
+                    try:
+                        result = f.result()
+                    except Exception as e:
+                        print('Worker {} failed: {}'.format(worker_ids[id(f)], e))
+                        failed += 1
+                        continue
+                    batch_ids.append(worker_ids[id(f)])
+                    batch_stats.append(f.stats)
+                    batch_results.append(result)
+                    if quantity is not None:
+                        done_work += quantity(result)
+
+                if self.store is not None and batch_ids:
+                    self.store.append_workers(batch_ids, batch_stats, batch_results)
+                worker_stats.update(zip(batch_ids, batch_stats))
+                results.update(zip(batch_ids, batch_results))
+
+                elapsed = time.time() - start_time
+                progress = '{}/{} workers done - {:.1f} s'.format(len(self.completed) + len(results),
+                                                                  len(iterdata), elapsed)
+                if quantity is not None:
+                    progress += ' - {:.2f} {} aggregate'.format(done_work / elapsed, unit)
+                print(progress)
+
+        end_time = time.time()
+        if failed:
+            print('{} workers failed, run again with --resume to retry them'.format(failed))
+
+        if self.store is None:
+            order = sorted(results)
+            res = dict(meta)
+            res.update({'start_time': start_time,
+                        'total_time': end_time - start_time,
+                        'worker_stats': [worker_stats[i] for i in order],
+                        'results': [results[i] for i in order]})
+            print_offsets(correct_clocks(res))
+            print_startup(res)
+            return res
+
+        sessions = self.meta.get('sessions', []) + [{'start_time': start_time, 'end_time': end_time,
+                                                     'workers': len(results), 'failed': failed}]
+        self.store.update_meta({'start_time': sessions[0]['start_time'],
+                                'total_time': float(np.sum([s['end_time'] - s['start_time'] for s in sessions])),
+                                'sessions': sessions})
+        self.store.compact()
+        print_offsets(correct_stored_clocks(self.store))
+        self.meta = dict(self.store.meta)
+        res = self.store.to_dict()
+        print_startup(res)
+        return res
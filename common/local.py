@@ -0,0 +1,207 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Local mode of the benchmarks. get_executor() returns the executor of the
+configured cloud backend or, in local mode, one running the workers with
+Lithops' localhost executor against its filesystem-backed storage. The
+storage seen by the workers can be shaped with injected latency, a
+per-request bandwidth cap and throttling errors, so the benchmarks and
+their plots can be run end to end on a single machine.
+"""
+
+import io
+import time
+import random
+import inspect
+import functools
+import click
+
+from lithops.executor import FunctionExecutor
+
+from common.startup import InstrumentedExecutor
+
+# set by configure()
+LOCAL = {'local': False, 'latency': 0.0, 'bandwidth': 0.0, 'throttle': 0.0}
+
+
+class ThrottleError(Exception):
+    """
+    Injected throttling error, looks like an HTTP 503 SlowDown response
+    """
+    status_code = 503
+
+    def __init__(self):
+        super().__init__('SlowDown: injected throttling error')
+
+
+class PacedReader(object):
+    """
+    File-like wrapper that delays reads so that they never go faster
+    than bandwidth bytes/sec (0 for no limit)
+    """
+
+    def __init__(self, fileobj, bandwidth):
+        self.fileobj = fileobj
+        self.bandwidth = bandwidth
+        self.start_time = time.time()
+        self.bytes_read = 0
+
+    def read(self, bytes_requested=-1):
+        data = self.fileobj.read(bytes_requested)
+        self.bytes_read += len(data)
+        if self.bandwidth:
+            delay = self.bytes_read / self.bandwidth - (time.time() - self.start_time)
+            if delay > 0:
+                time.sleep(delay)
+        return data
+
+    def close(self):
+        if hasattr(self.fileobj, 'close'):
+            self.fileobj.close()
+
+
+class ShapedStorage(object):
+    """
+    Wraps a Lithops Storage. Every request waits latency seconds and fails
+    with a ThrottleError with probability throttle, and object bodies are
+    sent and received at up to bandwidth bytes/sec per request. Other
+    attributes are passed through to the wrapped storage.
+    """
+
+    def __init__(self, storage, latency=0.0, bandwidth=0.0, throttle=0.0):
+        self.storage = storage
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle = throttle
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def request(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle and random.random() < self.throttle:
+            raise ThrottleError()
+
+    def put_object(self, bucket, key, body):
+        self.request()
+        if not hasattr(body, 'read'):
+            body = io.BytesIO(body)
+        reader = PacedReader(body, self.bandwidth)
+        chunks = [reader.read(1024*1024)]
+        while len(chunks[-1]) > 0:
+            chunks.append(reader.read(1024*1024))
+        return self.storage.put_object(bucket, key, b''.join(chunks))
+
+    def get_object(self, bucket, key, stream=False, extra_get_args={}):
+        self.request()
+        data = self.storage.get_object(bucket, key, stream=False, extra_get_args=extra_get_args)
+        reader = PacedReader(io.BytesIO(data), self.bandwidth)
+        if stream:
+            return reader
+        return reader.read()
+
+    def head_object(self, bucket, key):
+        self.request()
+        return self.storage.head_object(bucket, key)
+
+    def list_keys(self, bucket, prefix=None):
+        self.request()
+        return self.storage.list_keys(bucket, prefix)
+
+    def delete_object(self, bucket, key):
+        self.request()
+        return self.storage.delete_object(bucket, key)
+
+    def delete_objects(self, bucket, key_list):
+        self.request()
+        return self.storage.delete_objects(bucket, key_list)
+
+
+def shaped(func, latency, bandwidth, throttle):
+    """
+    Wraps a worker function so that its storage argument is a
+    ShapedStorage. The signature is kept, so Lithops still passes the
+    storage to it.
+    """
+    if 'storage' not in inspect.signature(func).parameters:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        kwargs['storage'] = ShapedStorage(kwargs['storage'], latency, bandwidth, throttle)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+class ShapedExecutor(object):
+    """
+    FunctionExecutor whose mapped functions see a ShapedStorage
+    """
+
+    def __init__(self, executor, latency, bandwidth, throttle):
+        self.executor = executor
+        self.shaping = (latency, bandwidth, throttle)
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+    def map(self, map_function, map_iterdata, **kwargs):
+        return self.executor.map(shaped(map_function, *self.shaping), map_iterdata, **kwargs)
+
+
+def configure(local=False, latency=0.0, bandwidth=0.0, throttle=0.0):
+    """
+    Sets the mode of the executors returned by get_executor(): latency in
+    seconds, bandwidth in bytes/sec and throttle as the fraction of the
+    requests that fail
+    """
+    LOCAL.update({'local': local, 'latency': latency, 'bandwidth': bandwidth, 'throttle': throttle})
+
+
+def get_executor(runtime_memory=1024, **kwargs):
+    """
+    Executor of the benchmarks, whose mapped functions report their
+    startup cost (see common.startup)
+    """
+    if LOCAL['local']:
+        executor = FunctionExecutor(backend='localhost', storage='localhost', **kwargs)
+    else:
+        executor = FunctionExecutor(runtime_memory=runtime_memory, **kwargs)
+    executor = InstrumentedExecutor(executor)
+    if LOCAL['latency'] or LOCAL['bandwidth'] or LOCAL['throttle']:
+        executor = ShapedExecutor(executor, LOCAL['latency'], LOCAL['bandwidth'], LOCAL['throttle'])
+    return executor
+
+
+def local_options(func):
+    """
+    Adds the local mode and storage shaping options to a click command or
+    group, and configures the executors with them before running it
+    """
+
+    @click.option('--local', is_flag=True, help="run the workers with Lithops' localhost executor and storage")
+    @click.option('--latency_ms', default=0.0, help='latency injected in every storage request, in ms', type=float)
+    @click.option('--bandwidth_mb', default=0.0, help='bandwidth cap of every storage request in MB/s, 0 for none', type=float)
+    @click.option('--throttle', default=0.0, help='fraction of the storage requests failing with a throttling error', type=float)
+    @functools.wraps(func)
+    def wrapper(*args, local, latency_ms, bandwidth_mb, throttle, **kwargs):
+        configure(local, latency_ms / 1000, bandwidth_mb * 1e6, throttle)
+        return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,143 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import numpy as np
+
+
+class RandomDataGenerator(object):
+    """
+    A file-like object which generates random data.
+    1. Never actually keeps all the data in memory so
+    can be used to generate huge files.
+    2. Actually generates random data to eliminate
+    false metrics based on compression.
+
+    It does this by precomputing a ring of RING_BLOCKS random
+    1MB blocks from np.random and serving every read as a view
+    over that ring, so producing the payload costs at most one
+    memory copy per byte. The ring is padded with a copy of its
+    first block, which makes any read of up to BLOCK_SIZE_BYTES
+    a single contiguous slice.
+
+    A generator can also represent a window [offset, offset+bytes_total)
+    of a larger object, see part(). first_read_time records when the
+    client first pulled bytes from it, i.e. the first byte of an upload,
+    and the bytes pulled are added to sampler, if any.
+    """
+
+    BLOCK_SIZE_BYTES = 1024*1024
+    RING_BLOCKS = 16
+
+    def __init__(self, bytes_total, offset=0, ring=None, zero_copy=False, sampler=None):
+        self.bytes_total = bytes_total
+        self.offset = offset
+        self.zero_copy = zero_copy
+        self.sampler = sampler
+        self.pos = 0
+        self.first_read_time = None
+        if ring is None:
+            ring = self.create_ring()
+        self.ring = ring
+        self.ring_view = memoryview(ring)
+        self.ring_size = len(ring) - self.BLOCK_SIZE_BYTES
+
+    @classmethod
+    def create_ring(cls):
+        ring_size = cls.RING_BLOCKS * cls.BLOCK_SIZE_BYTES
+        ring = np.empty(ring_size + cls.BLOCK_SIZE_BYTES, dtype=np.uint8)
+        ring[:ring_size] = np.random.randint(0, 256, dtype=np.uint8, size=ring_size)
+        ring[ring_size:] = ring[:cls.BLOCK_SIZE_BYTES]
+        return ring
+
+    def part(self, offset, bytes_total):
+        """
+        Returns a new generator over [offset, offset+bytes_total) of this
+        object. The block ring is shared, so parts are cheap to create.
+        """
+        return RandomDataGenerator(bytes_total, offset=self.offset + offset,
+                                   ring=self.ring, zero_copy=self.zero_copy, sampler=self.sampler)
+
+    def __len__(self):
+        return self.bytes_total
+
+    @property
+    def len(self):
+        return self.bytes_total
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 0:
+            self.pos = pos
+        elif whence == 1:
+            self.pos += pos
+        elif whence == 2:
+            self.pos = self.bytes_total - pos
+        return self.pos
+
+    def _bytes_out(self, bytes_requested):
+        if self.first_read_time is None:
+            self.first_read_time = time.time()
+        remaining_bytes = max(self.bytes_total - self.pos, 0)
+        if bytes_requested is None or bytes_requested < 0:
+            bytes_out = remaining_bytes
+        else:
+            bytes_out = min(remaining_bytes, bytes_requested)
+        if self.sampler is not None:
+            self.sampler.add(bytes_out)
+        return bytes_out
+
+    def _ring_pos(self):
+        return (self.offset + self.pos) % self.ring_size
+
+    def _views(self, bytes_out):
+        # contiguous ring slices covering the next bytes_out bytes
+        while bytes_out > 0:
+            ring_pos = self._ring_pos()
+            chunk_size = min(bytes_out, self.ring_size - ring_pos + self.BLOCK_SIZE_BYTES)
+            yield self.ring_view[ring_pos:ring_pos + chunk_size]
+            self.pos += chunk_size
+            bytes_out -= chunk_size
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        bytes_out = self._bytes_out(len(view))
+        byte_pos = 0
+        for chunk in self._views(bytes_out):
+            view[byte_pos:byte_pos + len(chunk)] = chunk
+            byte_pos += len(chunk)
+        return bytes_out
+
+    def read(self, bytes_requested=-1):
+        bytes_out = self._bytes_out(bytes_requested)
+        if bytes_out == 0:
+            return b''
+
+        if bytes_out <= self.BLOCK_SIZE_BYTES:
+            ring_pos = self._ring_pos()
+            self.pos += bytes_out
+            chunk = self.ring_view[ring_pos:ring_pos + bytes_out]
+            return chunk if self.zero_copy else chunk.tobytes()
+
+        return b''.join(self._views(bytes_out))
@@ -0,0 +1,170 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Cost of the runs. The per-provider rates are loaded from a JSON file
+(pricing.json at the top of the repo by default): the GB-second, the
+invocation and the billing granularity of the FaaS backends (plus the
+vCPU-second and vCPUs of the backends that bill CPU apart), and the
+PUT and GET request prices of the storage backends. Providers are named
+as the result directories; the Lithops backend names that differ are
+mapped to them in its 'backends' section.
+"""
+
+import os
+import json
+import math
+
+PRICING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'pricing.json')
+
+
+def load_pricing(path=None):
+    with open(os.path.expanduser(path or PRICING_FILE)) as f:
+        return json.load(f)
+
+
+def executor_backends(exc):
+    """
+    Lithops compute and storage backend names of an executor, None if
+    they cannot be found
+    """
+    storage = getattr(exc, 'storage', None)
+    return {'backend': getattr(exc, 'backend', None),
+            'storage_backend': getattr(storage, 'backend', None)}
+
+
+def provider_rates(pricing, kind, provider):
+    """
+    Rates of a 'compute' or 'storage' provider, None if it has no pricing
+    """
+    if provider is None:
+        return None
+    provider = pricing.get('backends', {}).get(provider, provider)
+    return pricing[kind].get(provider)
+
+
+def billed_seconds(worker_stats, granularity_ms=1):
+    """
+    Billed duration of every worker: the time its container ran, rounded
+    up to the billing granularity
+    """
+    seconds = []
+    for s in worker_stats:
+        ms = (s['worker_end_tstamp'] - s['worker_start_tstamp']) * 1000
+        seconds.append(math.ceil(ms / granularity_ms) * granularity_ms / 1000)
+    return seconds
+
+
+def request_counts(res):
+    """
+    PUT and GET requests made by the workers of a storage run, including
+    the failed and throttled ones. Legacy results without per-request
+    times count as one request per worker. Every ranged read of an
+    object also sends a HEAD for its size, priced as a GET.
+    """
+    puts = gets = 0
+    for r in res['results']:
+        if 'requests' in r:
+            n = len(r['requests']) + r.get('throttled', 0) + r.get('errors', 0)
+        elif 'mb_rate' in r:
+            n = 1
+        else:
+            continue
+        if 'bytes_read' in r:
+            gets += n
+            if 'ranges' in r or res.get('range_size'):
+                gets += res.get('read_times') or 1
+        elif 'bytes_written' in r or 'keynames' in res:
+            # a multipart upload also creates and completes the upload
+            puts += n + (2 if r.get('parts') is not None and len(r['parts']) else 0)
+    return puts, gets
+
+
+def work_done(res):
+    """
+    GFLOP computed and GB transferred by the workers of a run
+    """
+    results = res['results']
+    gflop = 0.0
+    if res.get('est_flops') and res.get('workers'):
+        gflop = res['est_flops'] * len(results) / res['workers'] / 1e9
+    elif results and all('tiles' in r for r in results):
+        gflop = sum(r['flops'] for r in results) / 1e9
+
+    transferred = 0.0
+    for r in results:
+        if 'bytes_written' in r or 'bytes_read' in r:
+            transferred += r.get('bytes_written', 0) + r.get('bytes_read', 0)
+        elif 'mb_rate' in r and 'start_time' in r:
+            transferred += r['mb_rate'] * (r['end_time'] - r['start_time']) * 1e6
+    return gflop, transferred / 1e9
+
+
+def run_cost(res, pricing, memory=None, backend=None, storage_backend=None):
+    """
+    Cost of a run: GB-seconds and invocations of its workers, and the
+    requests they made to the storage. memory (MB) and the backends are
+    taken from the run meta when it has them. Returns None if the compute
+    backend has no pricing.
+    """
+    compute = provider_rates(pricing, 'compute', res.get('backend') or backend)
+    if compute is None:
+        return None
+    storage = provider_rates(pricing, 'storage', res.get('storage_backend') or storage_backend)
+    memory = res.get('memory') or memory
+
+    seconds = sum(billed_seconds(res['worker_stats'], compute['granularity_ms']))
+    gb_seconds = seconds * memory / 1024
+    vcpu_seconds = seconds * compute.get('vcpus', 0)
+    invocations = len(res['worker_stats'])
+    puts, gets = request_counts(res)
+    cost = {'memory': memory,
+            'gb_seconds': gb_seconds,
+            'vcpu_seconds': vcpu_seconds,
+            'invocations': invocations,
+            'put_requests': puts,
+            'get_requests': gets,
+            'compute_cost': gb_seconds * compute['gb_second'] + vcpu_seconds * compute.get('vcpu_second', 0.0),
+            'invocation_cost': invocations * compute['invocation'],
+            'request_cost': puts * storage['put_request'] + gets * storage['get_request'] if storage else 0.0}
+    cost['cost'] = cost['compute_cost'] + cost['invocation_cost'] + cost['request_cost']
+
+    gflop, gb = work_done(res)
+    cost['gflop'] = gflop
+    cost['gb'] = gb
+    cost['gflops_per_dollar'] = gflop / cost['cost'] if cost['cost'] and gflop else None
+    cost['gb_per_dollar'] = gb / cost['cost'] if cost['cost'] and gb else None
+    return cost
+
+
+def print_cost(res, pricing=None, memory=None):
+    """
+    Prints the cost of a run and its throughput per dollar, and returns
+    the cost dict (None if the backend has no pricing)
+    """
+    pricing = pricing or load_pricing()
+    cost = run_cost(res, pricing, memory)
+    if cost is None:
+        print('No pricing for backend {}, cost not computed'.format(res.get('backend')))
+        return None
+    print('Cost: {:.6f} {} - {:.1f} GB-s, {} invocations, {} PUT and {} GET requests'.format(
+        cost['cost'], pricing['currency'], cost['gb_seconds'], cost['invocations'],
+        cost['put_requests'], cost['get_requests']))
+    if cost['gflops_per_dollar']:
+        print('GFLOPS per dollar: {:.1f}'.format(cost['gflops_per_dollar']))
+    if cost['gb_per_dollar']:
+        print('GB transferred per dollar: {:.1f}'.format(cost['gb_per_dollar']))
+    return cost
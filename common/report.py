@@ -0,0 +1,234 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Summary statistics of stored runs, for comparing providers and scales
+and for catching regressions against a baseline run.
+"""
+
+import os
+import glob
+import math
+import numpy as np
+
+from common.store import MANIFEST, load_results
+from common.timeline import time_bins, sweep
+from common.pricing import run_cost
+from common.clock import corrected
+
+RATE_PERCENTILES = [50, 95, 99]
+
+
+def find_runs(paths):
+    """
+    Runs saved under paths: columnar run directories and legacy pickles
+    that have not been converted
+    """
+    runs = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isfile(os.path.join(path, MANIFEST)) or os.path.isfile(path):
+            runs.append(path)
+            continue
+        manifests = glob.glob(os.path.join(path, '**', MANIFEST), recursive=True)
+        run_dirs = {os.path.dirname(m) for m in manifests}
+        pickles = [p for p in glob.glob(os.path.join(path, '**', '*.pickle'), recursive=True)
+                   if p[:-len('.pickle')] not in run_dirs]
+        runs.extend(sorted(run_dirs) + sorted(pickles))
+    return runs
+
+
+def run_label(path):
+    """
+    (provider, name) of a run, taken from its directory and file names
+    """
+    path = path[:-len('.pickle')] if path.endswith('.pickle') else path
+    return os.path.basename(os.path.dirname(os.path.abspath(path))), os.path.basename(path)
+
+
+def worker_rates(res):
+    """
+    Per-worker rate of a run and its unit: GFLOPS of the flops benchmark
+    or MB/s of the storage benchmarks. None if the run has neither.
+    """
+    results = res.get('results', [])
+    if results and all('flops' in r for r in results):
+        return np.array([r['flops'] for r in results]) / 1e9, 'GFLOPS'
+    if results and all('mb_rate' in r for r in results):
+        return np.array([r['mb_rate'] for r in results]), 'MB/s'
+    return None, None
+
+
+# result key that identifies the benchmark and operation of a run, in
+# the order they are checked (dgemm results also have flops)
+RUN_KINDS = [('dgemm', 'tiles'), ('flops', 'flops'), ('write', 'bytes_written'), ('read', 'bytes_read'),
+             ('shuffle_map', 'gen_time'), ('shuffle_reduce', 'combine_time')]
+
+
+def run_kind(res, path):
+    """
+    Benchmark and operation of a run, from the keys of its results or,
+    for legacy storage runs that lack them, from its _write or _read name
+    """
+    results = res.get('results', [])
+    for kind, key in RUN_KINDS:
+        if results and all(key in r for r in results):
+            return kind
+    name = run_label(path)[1]
+    for kind in ('write', 'read'):
+        if name.endswith('_' + kind):
+            return kind
+    return None
+
+
+def worker_intervals(res):
+    """
+    Start and end times of the work done by every worker: the times in
+    its result if it has them, else those of its function in worker_stats,
+    corrected for clock skew if the run was
+    """
+    results = res['results']
+    if all('start_time' in r and 'end_time' in r for r in results):
+        return (np.array([corrected(r, 'start_time') for r in results]),
+                np.array([corrected(r, 'end_time') for r in results]))
+    stats = res['worker_stats']
+    return (np.array([corrected(s, 'worker_func_start_tstamp') for s in stats]),
+            np.array([corrected(s, 'worker_func_end_tstamp') for s in stats]))
+
+
+def summarize(res, bins=200):
+    """
+    Summary statistics of a run: per-worker rate percentiles, peak and
+    mean aggregate rate, straggler ratio (slowest over median worker
+    duration) and peak and mean number of workers running
+    """
+    rates, unit = worker_rates(res)
+    if rates is None or len(rates) == 0:
+        return None
+    start, end = worker_intervals(res)
+    tzero = start.min()
+    start, end = start - tzero, end - tzero
+    span = end.max()
+    durations = end - start
+    runtime_bins = time_bins(span, span / bins, endpoint=False)
+
+    summary = {'workers': len(rates), 'unit': unit}
+    for p in RATE_PERCENTILES:
+        summary['p{}'.format(p)] = np.percentile(rates, p)
+    summary.update({'peak_aggregate': sweep(runtime_bins, start, end, rates).max(),
+                    'mean_aggregate': (rates * durations).sum() / span,
+                    'straggler_ratio': durations.max() / np.median(durations),
+                    'peak_concurrency': int(sweep(runtime_bins, start, end).max()),
+                    'mean_concurrency': durations.sum() / span,
+                    'span': span})
+    return summary
+
+
+def report(paths):
+    """
+    Summaries of all the runs found under paths, one dict per run
+    """
+    rows = []
+    for path in find_runs(paths):
+        try:
+            summary = summarize(load_results(path))
+        except Exception as e:
+            print('Skipping {}: {}'.format(path, e))
+            continue
+        if summary is None:
+            continue
+        provider, name = run_label(path)
+        rows.append(dict({'provider': provider, 'run': name}, **summary))
+    return rows
+
+
+def cost_report(paths, pricing, memory=1024, backend=None, storage_backend=None):
+    """
+    Cost and throughput per dollar of all the runs found under paths, one
+    dict per run. Runs that do not record their memory and backends get
+    the provider of their directory, or else the given ones.
+    """
+    rows = []
+    for path in find_runs(paths):
+        provider, name = run_label(path)
+        try:
+            res = load_results(path)
+            if not res.get('worker_stats'):
+                continue
+            cost = run_cost(res, pricing, memory,
+                            provider if provider in pricing['compute'] else backend,
+                            provider if provider in pricing['storage'] else storage_backend)
+        except Exception as e:
+            print('Skipping {}: {}'.format(path, e))
+            continue
+        if cost is None:
+            print('Skipping {}: no pricing for its backend'.format(path))
+            continue
+        rows.append(dict({'provider': provider, 'run': name, 'workers': len(res['worker_stats'])}, **cost))
+    return rows
+
+
+def rankdata(x):
+    """
+    Ranks of x starting at 1, ties getting the average of their ranks
+    """
+    values, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    first_rank = np.cumsum(counts) - counts + 1
+    return (first_rank + (counts - 1) / 2)[inverse]
+
+
+def mann_whitney_less(x, y):
+    """
+    One-sided Mann-Whitney U test of x being stochastically smaller than
+    y, with the normal approximation corrected for ties and continuity.
+    Returns U and the p-value.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n1, n2 = len(x), len(y)
+    ranks = rankdata(np.concatenate([x, y]))
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+
+    n = n1 + n2
+    unused, counts = np.unique(ranks, return_counts=True)
+    tie_term = (counts**3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2 + 0.5) / sigma
+    return u, 0.5 * math.erfc(-z / math.sqrt(2))
+
+
+def compare(baseline, candidate, alpha=0.01, min_slowdown=0.05):
+    """
+    Compares the per-worker rates of a candidate run against a baseline
+    run. The slowdown is significant if the candidate rates are smaller
+    (one-sided Mann-Whitney U test, p < alpha) and its median rate is at
+    least min_slowdown lower.
+    """
+    base_rates, unit = worker_rates(baseline)
+    cand_rates, cand_unit = worker_rates(candidate)
+    if base_rates is None or cand_rates is None or unit != cand_unit:
+        raise ValueError('Runs without comparable per-worker rates')
+    u, p_value = mann_whitney_less(cand_rates, base_rates)
+    change = np.median(cand_rates) / np.median(base_rates) - 1
+    return {'unit': unit,
+            'baseline_median': np.median(base_rates),
+            'candidate_median': np.median(cand_rates),
+            'change': change,
+            'u': u,
+            'p_value': p_value,
+            'regression': bool(p_value < alpha and change <= -min_slowdown)}
@@ -0,0 +1,105 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Startup cost of the workers. The mapped functions are sent as a nested,
+separately serialized payload that the worker only loads when it is
+called, so the time spent importing the modules the function needs and
+the size of its serialized code can be measured on every worker. This
+module is shipped to the workers, so it must stay light.
+"""
+
+import time
+import pickle
+import inspect
+import cloudpickle
+
+STARTUP_KEYS = ['import_time', 'payload_bytes']
+
+
+class Instrumented(object):
+    """
+    Callable wrapping a worker function. It is serialized as the pickled
+    function, which is loaded on the first call. Dict results get the
+    import_time (seconds to load the function and the modules it imports,
+    0 if it was already loaded in a warm worker) and the payload_bytes of
+    the function.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__signature__ = inspect.signature(func)
+        self.__name__ = getattr(func, '__name__', type(self).__name__)
+        self.payload_bytes = 0
+        self.import_time = 0.0
+
+    def __getstate__(self):
+        payload = cloudpickle.dumps(self.func)
+        return {'payload': payload, 'payload_bytes': len(payload),
+                'signature': self.__signature__, 'name': self.__name__}
+
+    def __setstate__(self, state):
+        self.func = None
+        self.payload = state['payload']
+        self.payload_bytes = state['payload_bytes']
+        self.__signature__ = state['signature']
+        self.__name__ = state['name']
+
+    def __call__(self, *args, **kwargs):
+        if self.func is None:
+            start_time = time.time()
+            self.func = pickle.loads(self.payload)
+            self.import_time = time.time() - start_time
+            self.payload = None
+        result = self.func(*args, **kwargs)
+        if isinstance(result, dict):
+            result.update({'import_time': self.import_time, 'payload_bytes': self.payload_bytes})
+        return result
+
+
+class InstrumentedExecutor(object):
+    """
+    FunctionExecutor whose mapped functions are Instrumented
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+    def map(self, map_function, map_iterdata, **kwargs):
+        return self.executor.map(Instrumented(map_function), map_iterdata, **kwargs)
+
+
+def print_startup(res):
+    """
+    Prints the serialized payload sizes and the module import times of
+    the workers of a run
+    """
+    results = [r for r in res['results'] if isinstance(r, dict) and 'import_time' in r]
+    if not results:
+        return
+    import_times = [r['import_time'] for r in results]
+    line = 'Worker startup: function payload {:.1f} KB'.format(results[0]['payload_bytes'] / 1024)
+    stats = res['worker_stats']
+    for label, key in [('modules', 'func_module_size_bytes'), ('data per call', 'func_data_size_bytes')]:
+        sizes = [s[key] for s in stats if s.get(key) is not None and s[key] == s[key]]
+        if sizes:
+            line += ', {} {:.1f} KB'.format(label, max(sizes) / 1024)
+    line += ' - module import mean {:.1f} ms, max {:.1f} ms'.format(
+        sum(import_times) / len(import_times) * 1000, max(import_times) * 1000)
+    print(line)
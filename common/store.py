@@ -0,0 +1,471 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Columnar, append-only store for benchmark results.
+
+A run is saved as a directory holding a manifest.json and one .npy file
+per column. The per-worker 'worker_stats' and 'results' dicts become
+typed columns of the tables with the same name, one row per worker.
+Arrays and lists found in them (per-request timestamps, ranges, parts,
+latencies...) become sample tables such as 'results.requests', with a
+'worker' column pointing back to the worker row. The workers whose
+samples are empty are listed in the 'empty' entry of the sample table,
+so that they are loaded back as empty values. Everything else in the
+run dict (start_time, keynames, ...) is kept in the manifest 'meta'.
+
+Tables are written in chunks, so rows can be appended while a run is in
+progress. Columns are memory-mapped when loaded and only the requested
+ones are read from disk.
+"""
+
+import os
+import json
+import pickle
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+WORKER_TABLES = ['worker_stats', 'results']
+SAMPLE_COLUMNS = {'requests': ['issued', 'first_byte', 'last_byte']}
+
+# worker_stats keys written by older Lithops (and PyWren-IBM) versions
+LEGACY_STATS_KEYS = {'start_time': 'worker_start_tstamp',
+                     'end_time': 'worker_end_tstamp',
+                     'function_start_time': 'worker_func_start_tstamp',
+                     'function_end_time': 'worker_func_end_tstamp',
+                     'start_tstamp': 'worker_start_tstamp',
+                     'end_tstamp': 'worker_end_tstamp',
+                     'function_start_tstamp': 'worker_func_start_tstamp',
+                     'function_end_tstamp': 'worker_func_end_tstamp',
+                     'status_done_tstamp': 'host_status_done_tstamp',
+                     'data_size_bytes': 'func_data_size_bytes'}
+
+
+def normalize_worker_stats(worker_stats):
+    """
+    Renames the worker_stats keys of older Lithops versions to the
+    current ones, so that old and new runs can be analyzed together
+    """
+    normalized = []
+    for stats in worker_stats:
+        if 'worker_start_tstamp' not in stats and ('start_time' in stats or 'start_tstamp' in stats):
+            stats = {LEGACY_STATS_KEYS.get(k, k): v for k, v in stats.items()}
+        normalized.append(stats)
+    return normalized
+
+
+def column_array(values):
+    """
+    Returns a typed column for a list of python values. None marks a
+    missing value: NaN for numbers, False for booleans, '' for strings.
+    Returns None if all the values are missing.
+    """
+    present = [v for v in values if v is not None]
+    if not present:
+        return None
+    if all(isinstance(v, (bool, np.bool_)) for v in present):
+        return np.array([v is not None and bool(v) for v in values], dtype=bool)
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, (bool, np.bool_)) for v in present):
+        if len(present) == len(values):
+            return np.array(values, dtype=np.int64)
+    if all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_))
+           for v in present):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(['' if v is None else str(v) for v in values])
+
+
+def missing_column(dtype, rows):
+    """
+    Fill for a column absent from a whole chunk: NaN, -1, False or ''
+    """
+    if dtype.kind == 'f':
+        return np.full(rows, np.nan)
+    if dtype.kind in 'iu':
+        return np.full(rows, -1, dtype=dtype)
+    return np.zeros(rows, dtype=dtype)
+
+
+def flatten_record(record, prefix=''):
+    """
+    Splits a worker dict into scalar columns and samples. Nested dicts
+    are flattened with dotted names.
+    """
+    scalars = {}
+    samples = {}
+    for key, value in record.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            nested_scalars, nested_samples = flatten_record(value, name + '.')
+            scalars.update(nested_scalars)
+            samples.update(nested_samples)
+        elif isinstance(value, np.ndarray):
+            samples[name] = ('array{}d'.format(min(value.ndim, 2)), value)
+        elif isinstance(value, (list, tuple)):
+            if value and all(isinstance(v, dict) for v in value):
+                samples[name] = ('records', value)
+            else:
+                samples[name] = ('values', value)
+        elif isinstance(value, np.generic):
+            scalars[name] = value.item()
+        else:
+            scalars[name] = value
+    return scalars, samples
+
+
+def sample_columns(name, kind, value):
+    """
+    Returns the columns of the samples of one worker
+    """
+    if kind == 'records':
+        keys = list(dict.fromkeys(k for v in value for k in v))
+        return {k: column_array([v.get(k) for v in value]) for k in keys}
+    if kind == 'array2d':
+        value = np.asarray(value).reshape(len(value), -1)
+        names = SAMPLE_COLUMNS.get(name.split('.')[-1], [])
+        if len(names) != value.shape[1]:
+            names = ['c{}'.format(i) for i in range(value.shape[1])]
+        return {n: value[:, i] for i, n in enumerate(names)}
+    if kind == 'array1d':
+        return {'value': np.asarray(value).ravel()}
+    return {'value': column_array(list(value))}
+
+
+def concat_columns(chunks):
+    """
+    Concatenates the columns of several chunks, filling the columns
+    missing in some of them
+    """
+    names = list(dict.fromkeys(n for rows, cols in chunks for n in cols if cols[n] is not None))
+    columns = {}
+    for n in names:
+        dtype = np.result_type(*[cols[n].dtype for rows, cols in chunks if cols.get(n) is not None])
+        parts = [cols[n] if cols.get(n) is not None else missing_column(dtype, rows) for rows, cols in chunks]
+        columns[n] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    return columns
+
+
+def to_json(value):
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class ResultStore(object):
+    """
+    A run saved in columnar format. Open it with mode='w' to create it,
+    or mode='a' to append to an existing one.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = os.path.expanduser(path)
+        manifest_path = os.path.join(self.path, MANIFEST)
+
+        if mode == 'w' or (mode == 'a' and not os.path.exists(manifest_path)):
+            os.makedirs(self.path, exist_ok=True)
+            self.manifest = {'format': FORMAT_VERSION, 'meta': {}, 'tables': {}}
+            self._save_manifest()
+        else:
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest['format'] > FORMAT_VERSION:
+                raise ValueError('Unsupported result store format: {}'.format(self.manifest['format']))
+
+    def _save_manifest(self):
+        tmp_path = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+
+    @property
+    def meta(self):
+        return self.manifest['meta']
+
+    def update_meta(self, meta):
+        self.manifest['meta'].update(to_json(meta))
+        self._save_manifest()
+
+    @property
+    def tables(self):
+        return list(self.manifest['tables'])
+
+    def columns(self, table):
+        return list(self.manifest['tables'][table]['columns'])
+
+    def rows(self, table):
+        return sum(chunk['rows'] for chunk in self.manifest['tables'][table]['chunks'])
+
+    def append(self, table, columns, kind='records'):
+        """
+        Appends a chunk of rows to a table. All the columns must have
+        the same length.
+        """
+        columns = {n: c for n, c in columns.items() if c is not None}
+        rows = len(next(iter(columns.values())))
+        table_meta = self.table_meta(table, kind)
+        chunk_id = '{:05d}'.format(len(table_meta['chunks']))
+        chunk_dir = os.path.join(self.path, table, chunk_id)
+        os.makedirs(chunk_dir, exist_ok=True)
+
+        for n, c in columns.items():
+            np.save(os.path.join(chunk_dir, n + '.npy'), np.ascontiguousarray(c), allow_pickle=False)
+            table_meta['columns'].setdefault(n, c.dtype.str)
+
+        table_meta['chunks'].append({'id': chunk_id, 'rows': rows, 'columns': list(columns)})
+        self._save_manifest()
+
+    def table_meta(self, table, kind):
+        """
+        Manifest entry of a table, created if it does not exist. A table
+        holding only empty samples takes the kind of its first chunk.
+        """
+        table_meta = self.manifest['tables'].setdefault(table, {'kind': kind, 'columns': {}, 'chunks': []})
+        if not table_meta['chunks']:
+            table_meta['kind'] = kind
+        return table_meta
+
+    def append_empty(self, table, worker_ids, kind, width=0):
+        """
+        Records that the samples of some workers are empty. width is the
+        number of columns of empty 2d arrays.
+        """
+        table_meta = self.manifest['tables'].setdefault(table, {'kind': kind, 'columns': {}, 'chunks': []})
+        table_meta.setdefault('empty', []).extend(int(w) for w in worker_ids)
+        if kind == 'array2d':
+            table_meta['width'] = width
+        self._save_manifest()
+
+    def append_workers(self, worker_ids, worker_stats=None, results=None):
+        """
+        Appends the worker_stats and results of some workers, given by
+        their position in the run
+        """
+        worker_ids = np.asarray(worker_ids, dtype=np.int64)
+        for table, records in (('worker_stats', worker_stats), ('results', results)):
+            if not records:
+                continue
+            flat = [flatten_record(r if isinstance(r, dict) else {'value': r}) for r in records]
+
+            names = list(dict.fromkeys(n for scalars, samples in flat for n in scalars))
+            columns = {'worker': worker_ids}
+            columns.update({n: column_array([scalars.get(n) for scalars, samples in flat]) for n in names})
+            self.append(table, columns)
+
+            sample_names = list(dict.fromkeys(n for scalars, samples in flat for n in samples))
+            for name in sample_names:
+                chunks = []
+                empty = []
+                kind = None
+                empty_kind = None
+                width = 0
+                for worker_id, (scalars, samples) in zip(worker_ids, flat):
+                    if name not in samples:
+                        continue
+                    sample_kind, value = samples[name]
+                    if len(value) == 0:
+                        empty.append(worker_id)
+                        empty_kind = sample_kind
+                        if sample_kind == 'array2d':
+                            width = int(np.prod(np.shape(value)[1:]))
+                        continue
+                    kind = sample_kind
+                    cols = sample_columns(name, kind, value)
+                    rows = len(next(iter(cols.values())))
+                    cols['worker'] = np.full(rows, worker_id, dtype=np.int64)
+                    chunks.append((rows, cols))
+                if chunks:
+                    self.append('{}.{}'.format(table, name), concat_columns(chunks), kind=kind)
+                if empty:
+                    self.append_empty('{}.{}'.format(table, name), empty, empty_kind, width)
+
+    def load(self, table, columns=None, mmap=True):
+        """
+        Returns a dict of column arrays. Only the given columns are read,
+        memory-mapped unless mmap=False.
+        """
+        table_meta = self.manifest['tables'][table]
+        names = list(table_meta['columns']) if columns is None else list(columns)
+        chunks = []
+        for chunk in table_meta['chunks']:
+            chunk_dir = os.path.join(self.path, table, chunk['id'])
+            cols = {n: np.load(os.path.join(chunk_dir, n + '.npy'), mmap_mode='r' if mmap else None)
+                    for n in names if n in chunk['columns']}
+            chunks.append((chunk['rows'], cols))
+        return concat_columns(chunks)
+
+    def compact(self):
+        """
+        Rewrites every table as a single chunk
+        """
+        for table, table_meta in list(self.manifest['tables'].items()):
+            if len(table_meta['chunks']) <= 1:
+                continue
+            columns = self.load(table, mmap=False)
+            old_chunks = table_meta['chunks']
+            table_meta['chunks'] = []
+            self.append(table, columns, kind=table_meta['kind'])
+            for chunk in old_chunks:
+                chunk_dir = os.path.join(self.path, table, chunk['id'])
+                if chunk['id'] != table_meta['chunks'][0]['id']:
+                    for n in chunk['columns']:
+                        os.remove(os.path.join(chunk_dir, n + '.npy'))
+                    os.rmdir(chunk_dir)
+
+    def add_columns(self, table, columns):
+        """
+        Adds columns to a table stored as a single chunk (see compact),
+        or replaces them. Their rows follow the order of the table.
+        """
+        table_meta = self.manifest['tables'][table]
+        if len(table_meta['chunks']) != 1:
+            raise ValueError('Compact the run before adding columns to {}'.format(table))
+        chunk = table_meta['chunks'][0]
+        chunk_dir = os.path.join(self.path, table, chunk['id'])
+        for n, c in columns.items():
+            c = np.asarray(c)
+            if len(c) != chunk['rows']:
+                raise ValueError('Column {} has {} rows, table {} has {}'.format(n, len(c), table, chunk['rows']))
+            np.save(os.path.join(chunk_dir, n + '.npy'), np.ascontiguousarray(c), allow_pickle=False)
+            table_meta['columns'][n] = c.dtype.str
+            if n not in chunk['columns']:
+                chunk['columns'].append(n)
+        self._save_manifest()
+
+    def worker_records(self, table):
+        """
+        Rebuilds the per-worker dicts of 'worker_stats' or 'results',
+        including their samples, ordered by worker
+        """
+        if table not in self.manifest['tables']:
+            return [], []
+        columns = self.load(table)
+        order = np.argsort(columns['worker'], kind='stable')
+        worker_ids = [int(w) for w in columns['worker'][order]]
+        records = [{} for unused in worker_ids]
+        position = {w: i for i, w in enumerate(worker_ids)}
+
+        for n, c in columns.items():
+            if n == 'worker':
+                continue
+            for record, value in zip(records, c[order].tolist()):
+                set_nested(record, n, value)
+
+        prefix = table + '.'
+        for sample_table in self.tables:
+            if not sample_table.startswith(prefix):
+                continue
+            name = sample_table[len(prefix):]
+            table_meta = self.manifest['tables'][sample_table]
+            kind = table_meta['kind']
+            samples = self.load(sample_table)
+            sample_workers = samples.pop('worker', np.empty(0, dtype=np.int64))
+            order = np.argsort(sample_workers, kind='stable')
+            bounds = np.flatnonzero(np.diff(sample_workers[order])) + 1
+            for idx in np.split(order, bounds):
+                if len(idx) == 0 or int(sample_workers[idx[0]]) not in position:
+                    continue
+                record = records[position[int(sample_workers[idx[0]])]]
+                if kind == 'records':
+                    value = [dict(zip(samples, row)) for row in zip(*[samples[n][idx].tolist() for n in samples])]
+                elif kind == 'array2d':
+                    value = np.column_stack([samples[n][idx] for n in samples])
+                elif kind == 'array1d':
+                    value = np.array(samples['value'][idx])
+                else:
+                    value = samples['value'][idx].tolist()
+                set_nested(record, name, value)
+
+            for worker_id in table_meta.get('empty', []):
+                if worker_id in position:
+                    set_nested(records[position[worker_id]], name, empty_samples(kind, samples, table_meta))
+
+        return worker_ids, records
+
+    def to_dict(self):
+        """
+        Returns the run as the dict the benchmarks used to pickle
+        """
+        res = dict(self.meta)
+        for table in WORKER_TABLES:
+            worker_ids, res[table] = self.worker_records(table)
+        return res
+
+
+def empty_samples(kind, samples, table_meta):
+    """
+    Empty value of a worker with no samples, of the kind of the table
+    """
+    if kind == 'array2d':
+        return np.empty((0, len(samples) or table_meta.get('width', 0)))
+    if kind == 'array1d':
+        return np.empty(0, dtype=samples['value'].dtype if 'value' in samples else np.float64)
+    return []
+
+
+def set_nested(record, name, value):
+    keys = name.split('.')
+    for key in keys[:-1]:
+        record = record.setdefault(key, {})
+    record[keys[-1]] = value
+
+
+def save_results(res, path):
+    """
+    Saves a benchmark result dict as a columnar run
+    """
+    store = ResultStore(path, 'w')
+    worker_stats = res.get('worker_stats', [])
+    results = res.get('results', [])
+    store.append_workers(range(max(len(worker_stats), len(results))), worker_stats, results)
+    store.update_meta({k: v for k, v in res.items() if k not in WORKER_TABLES})
+    return store
+
+
+def result_path(path):
+    """
+    Path a run is loaded from: user expanded, with the .pickle extension
+    of legacy runs added if it was omitted
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isdir(path) and not path.endswith('.pickle') and os.path.isfile(path + '.pickle'):
+        path = path + '.pickle'
+    return path
+
+
+def load_results(path, meta_only=False):
+    """
+    Loads a run saved either as a columnar directory or as a legacy
+    pickle. path may omit the .pickle extension of legacy runs.
+    """
+    path = result_path(path)
+
+    if os.path.isdir(path):
+        store = ResultStore(path)
+        return dict(store.meta) if meta_only else store.to_dict()
+
+    with open(path, 'rb') as f:
+        res = pickle.load(f)
+    if 'worker_stats' in res:
+        res['worker_stats'] = normalize_worker_stats(res['worker_stats'])
+    return res
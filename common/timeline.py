@@ -0,0 +1,83 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Vectorized timelines over sets of [start, end) intervals, shared by the
+plots of all the benchmarks. Each interval adds its weight to the bins
+it covers; instead of filling a dense N x bins matrix, the interval
+edges are accumulated in a difference array and integrated with a
+cumulative sum, so memory is O(N + bins).
+"""
+
+import numpy as np
+
+
+def time_bins(max_seconds, bin_size=1.0, endpoint=True):
+    """
+    Returns bins covering [0, max_seconds] spaced about bin_size seconds
+    apart. bin_size can be below one second.
+    """
+    n_bins = max(int(round(max_seconds / bin_size)), 1)
+    return np.linspace(0, max_seconds, n_bins, endpoint=endpoint)
+
+
+def interval_bins(bins, start, end):
+    """
+    Returns the [first, last) bin indexes covered by every interval
+    """
+    return np.searchsorted(bins, start), np.searchsorted(bins, end)
+
+
+def sweep(bins, start, end, weights=None, spread=False):
+    """
+    Sums the weights of the intervals [start, end) covering each bin.
+
+    With weights=None every interval counts as 1, which gives the number
+    of intervals in flight per bin. With spread=True the weight of an
+    interval is divided evenly among the bins it covers instead of being
+    added to each of them.
+    """
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(len(start))
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), start.shape)
+
+    a, b = interval_bins(bins, start, end)
+    valid = b > a
+    a, b, weights = a[valid], b[valid], weights[valid]
+    if spread:
+        weights = weights / (b - a)
+
+    diff = np.bincount(a, weights=weights, minlength=len(bins) + 1) \
+        - np.bincount(b, weights=weights, minlength=len(bins) + 1)
+    return np.cumsum(diff[:len(bins)])
+
+
+def in_flight(bins, start, end):
+    """
+    Number of intervals in flight in each bin
+    """
+    return sweep(bins, start, end)
+
+
+def segments(start, end):
+    """
+    Horizontal (start, i) -> (end, i) segments, one per interval, in the
+    layout expected by matplotlib's LineCollection
+    """
+    y = np.arange(len(start))
+    return np.stack([np.column_stack([start, y]), np.column_stack([end, y])], axis=1)
@@ -0,0 +1,188 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import os
+import sys
+import time
+import uuid
+import click
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.store import save_results, load_results
+from common.collect import RunCollector
+from common.local import get_executor, local_options
+from common.clock import corrected
+
+DTYPES = ['float32', 'float64']
+STAGES = ['fetch', 'compute', 'write']
+
+
+def tile_key(run_prefix, matrix, i, j):
+    return '{}{}/{:04d}-{:04d}.npy'.format(run_prefix, matrix, i, j)
+
+
+def dumps(tile):
+    buf = io.BytesIO()
+    np.save(buf, tile)
+    return buf.getvalue()
+
+
+def loads(data):
+    return np.load(io.BytesIO(data))
+
+
+def dgemm(bucket_name, grid, block, dtype, workers_list, threads, memory, key_prefix, res_path=None):
+    """
+    Blocked C = A x B of grid x grid tiles of block x block elements kept
+    in object storage. A and B are generated once, one row of tiles per
+    worker; then, for every number of workers, each worker computes its
+    share of the output tiles, fetching the grid tiles of A and B it needs,
+    multiplying and writing its C tiles back.
+    """
+    run_id = uuid.uuid4().hex[:8].upper()
+    run_prefix = '{}dgemm-{}/'.format(key_prefix, run_id)
+    matn = grid * block
+    total_flops = 2 * matn**3
+
+    def generate_row(i, storage):
+        rng = np.random.default_rng(i)
+        start_time = time.time()
+        for matrix in ('A', 'B'):
+            for j in range(grid):
+                storage.put_object(bucket_name, tile_key(run_prefix, matrix, i, j),
+                                   dumps(rng.random((block, block)).astype(dtype)))
+        return {'start_time': start_time, 'end_time': time.time()}
+
+    def multiply_tiles(tiles, storage):
+        times = dict.fromkeys(STAGES, 0.0)
+        bytes_read = 0
+        bytes_written = 0
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for i, j in tiles:
+                t0 = time.time()
+                keys = [tile_key(run_prefix, 'A', i, k) for k in range(grid)] + \
+                       [tile_key(run_prefix, 'B', k, j) for k in range(grid)]
+                data = list(pool.map(lambda key: storage.get_object(bucket_name, key), keys))
+                bytes_read += sum(len(d) for d in data)
+                t1 = time.time()
+                C = np.zeros((block, block), dtype=dtype)
+                for k in range(grid):
+                    C += np.dot(loads(data[k]), loads(data[grid + k]))
+                t2 = time.time()
+                out = dumps(C)
+                storage.put_object(bucket_name, tile_key(run_prefix, 'C', i, j), out)
+                bytes_written += len(out)
+                t3 = time.time()
+                times['fetch'] += t1 - t0
+                times['compute'] += t2 - t1
+                times['write'] += t3 - t2
+        end_time = time.time()
+
+        flops = len(tiles) * 2 * grid * block**3
+        res = {'start_time': start_time, 'end_time': end_time, 'tiles': len(tiles), 'flops': flops,
+               'bytes_read': bytes_read, 'bytes_written': bytes_written,
+               'compute_flops': flops / times['compute'] if times['compute'] else 0.0}
+        res.update({'{}_time'.format(stage): t for stage, t in times.items()})
+        return res
+
+    exc = get_executor(runtime_memory=memory)
+    scaling = []
+    try:
+        print('Generating A and B: {} x {} tiles of {} x {} {}'.format(grid, grid, block, block, dtype))
+        start_time = time.time()
+        exc.get_result(exc.map(generate_row, range(grid)))
+        generate_time = time.time() - start_time
+        print('Generated {:.2f} MB in {:.2f} s'.format(2 * matn**2 * np.dtype(dtype).itemsize / 1e6, generate_time))
+
+        output_tiles = [(i, j) for i in range(grid) for j in range(grid)]
+        for workers in workers_list:
+            workers = min(workers, len(output_tiles))
+            iterdata = [[output_tiles[t] for t in range(w, len(output_tiles), workers)] for w in range(workers)]
+            print('Multiplying with {} workers'.format(workers))
+            res = RunCollector(res_path and '{}_{}'.format(res_path, workers)).map(
+                exc, multiply_tiles, [(tiles,) for tiles in iterdata],
+                meta={'grid': grid, 'block': block, 'dtype': dtype, 'workers': workers, 'threads': threads},
+                quantity=lambda r: r['flops'] / 1e9, unit='GFLOPS')
+            results = res['results']
+            exc.storage.delete_objects(bucket_name, exc.storage.list_keys(bucket_name, prefix=run_prefix + 'C/'))
+            if not results:
+                print('{} workers: no worker finished, point skipped'.format(workers))
+                continue
+
+            # the rates only count the tiles of the workers that finished
+            missing_tiles = len(output_tiles) - sum(r['tiles'] for r in results)
+            point = {'workers': workers,
+                     'finished_workers': len(results),
+                     'missing_tiles': missing_tiles,
+                     'total_time': res['total_time'],
+                     'func_time': max(corrected(r, 'end_time') for r in results) -
+                     min(corrected(r, 'start_time') for r in results),
+                     'effective_gflops': sum(r['flops'] for r in results) / res['total_time'] / 1e9,
+                     'compute_gflops': np.mean([r['compute_flops'] for r in results]) * len(results) / 1e9,
+                     'bytes_read': int(sum(r['bytes_read'] for r in results)),
+                     'bytes_written': int(sum(r['bytes_written'] for r in results))}
+            point.update({'{}_time'.format(stage): float(np.mean([r['{}_time'.format(stage)] for r in results]))
+                          for stage in STAGES})
+            scaling.append(point)
+            print('{} workers: {:.2f} effective GFLOPS ({:.2f} GFLOPS compute only) - '
+                  'mean per worker fetch/compute/write: {:.2f}/{:.2f}/{:.2f} s'.format(
+                      workers, point['effective_gflops'], point['compute_gflops'],
+                      point['fetch_time'], point['compute_time'], point['write_time']))
+            if missing_tiles:
+                print('{} workers: {} of {} tiles missing, the point is incomplete'.format(
+                    workers, missing_tiles, len(output_tiles)))
+    finally:
+        print('Deleting temp files...')
+        exc.storage.delete_objects(bucket_name, exc.storage.list_keys(bucket_name, prefix=run_prefix))
+
+    res = {'bucket_name': bucket_name, 'grid': grid, 'block': block, 'matn': matn, 'dtype': dtype,
+           'threads': threads, 'memory': memory, 'total_flops': total_flops, 'generate_time': generate_time,
+           'scaling': scaling}
+    if res_path:
+        save_results(res, res_path)
+    return res
+
+
+@click.command()
+@click.option('--bucket_name', help='bucket to keep the matrix tiles in')
+@click.option('--grid', default=4, help='tiles per side of the matrices', type=int)
+@click.option('--block', default=1024, help='elements per side of each tile', type=int)
+@click.option('--dtype', default='float64', type=click.Choice(DTYPES), help='dtype of the matrices')
+@click.option('--workers', default=[1, 4, 16], multiple=True, help='number of workers, can be repeated', type=int)
+@click.option('--threads', default=8, help='number of concurrent tile fetches within each worker', type=int)
+@click.option('--memory', default=2048, help='Memory per worker in MB', type=int)
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='dgemm_benchmark', help='filename to save results in')
+@local_options
+def run_benchmark(bucket_name, grid, block, dtype, workers, threads, memory, key_prefix, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    if True:
+        res = dgemm(bucket_name, grid, block, dtype, sorted(workers), threads, memory, key_prefix,
+                    '{}/{}'.format(outdir, name))
+    else:
+        res = load_results('{}/{}'.format(outdir, name))
+    from plots import create_dgemm_scaling_plot
+    create_dgemm_scaling_plot(res, '{}/{}_scaling.png'.format(outdir, name))
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -14,76 +14,293 @@
 # limitations under the License.
 #
 
+import os
+import sys
 import click
 import time
+import platform
 import numpy as np
-import pickle as pickle
+from collections import Counter
+from contextlib import contextmanager
 
-from lithops.executor import FunctionExecutor
-from plots import create_execution_histogram, create_rates_histogram, create_total_gflops_plot
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.store import save_results, load_results
+from common.collect import RunCollector
+from common.local import get_executor, local_options
+from common.pricing import load_pricing, run_cost, print_cost
 
 
-def compute_flops(loopcount, MAT_N):
+KERNELS = ['gemm', 'stream']
+DTYPES = ['float32', 'float64']
 
-    A = np.arange(MAT_N**2, dtype=np.float64).reshape(MAT_N, MAT_N)
-    B = np.arange(MAT_N**2, dtype=np.float64).reshape(MAT_N, MAT_N)
+# STREAM kernels: (arrays moved per element, operation). numpy computes
+# the triad in two passes, c*s into a and then b+a into a, which move 5
+# arrays instead of the 3 of a fused loop.
+STREAM_KERNELS = {'copy': (2, lambda a, b, c, s: np.copyto(a, b)),
+                  'scale': (2, lambda a, b, c, s: np.multiply(b, s, out=a)),
+                  'add': (3, lambda a, b, c, s: np.add(b, c, out=a)),
+                  'triad': (5, lambda a, b, c, s: np.add(b, np.multiply(c, s, out=a), out=a))}
 
-    start = time.time()
+
+@contextmanager
+def blas_threads_limit(blas_threads):
+    """
+    Limits the BLAS thread pool to blas_threads (0 keeps the default).
+    Yields the number of threads actually configured, or None if it
+    could not be set because threadpoolctl is not available.
+    """
+    if not blas_threads:
+        yield 0
+        return
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        print('threadpoolctl is not installed, cannot set the BLAS thread count')
+        yield None
+        return
+    with threadpool_limits(limits=blas_threads, user_api='blas'):
+        yield blas_threads
+
+
+def worker_info():
+    """
+    BLAS backend and CPU of the worker
+    """
+    info = {'cpu_model': platform.processor() or 'unknown',
+            'cpu_count': os.cpu_count(),
+            'blas': 'unknown'}
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    info['cpu_model'] = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    if hasattr(os, 'sched_getaffinity'):
+        info['cpu_count'] = len(os.sched_getaffinity(0))
+    try:
+        from threadpoolctl import threadpool_info
+        blas = [m for m in threadpool_info() if m['user_api'] == 'blas']
+        if blas:
+            info['blas'] = '{} {}'.format(blas[0]['internal_api'], blas[0]['version'])
+            info['blas_default_threads'] = blas[0]['num_threads']
+    except ImportError:
+        try:
+            info['blas'] = np.show_config(mode='dicts')['Build Dependencies']['blas']['name']
+        except Exception:
+            pass
+    return info
+
+
+def gemm_times(loopcount, MAT_N, dtype):
+    A = np.random.random((MAT_N, MAT_N)).astype(dtype)
+    B = np.random.random((MAT_N, MAT_N)).astype(dtype)
+    C = np.empty((MAT_N, MAT_N), dtype=dtype)
+
+    # warm-up, not timed
+    np.dot(A, B, out=C)
+
+    times = []
     for i in range(loopcount):
-        c = np.sum(np.dot(A, B))
+        start = time.time()
+        np.dot(A, B, out=C)
+        times.append(time.time() - start)
+    return times
 
-    FLOPS = 2 * MAT_N**3 * loopcount
-    end = time.time()
-    return {'flops': FLOPS / (end-start)}
 
+def stream_times(loopcount, stream_mb, op):
+    n = stream_mb * 1024**2 // 8
+    a = np.zeros(n)
+    b = np.ones(n)
+    c = np.full(n, 2.0)
 
-def benchmark(workers, memory, loopcount, matn):
-    iterable = [(loopcount, matn) for i in range(workers)]
+    # warm-up, not timed
+    op(a, b, c, 3.0)
 
-    exc = FunctionExecutor(runtime_memory=memory)
-    start_time = time.time()
-    worker_futures = exc.map(compute_flops, iterable)
-    results = exc.get_result()
-    end_time = time.time()
+    times = []
+    for i in range(loopcount):
+        start = time.time()
+        op(a, b, c, 3.0)
+        times.append(time.time() - start)
+    return times
+
+
+def compute_flops(loopcount, matns, dtypes=('float64',), kernels=('gemm',), blas_threads=0, stream_mb=64):
+    """
+    Runs the kernel suite: a GEMM for every dtype and matrix size, and
+    the STREAM copy/scale/add/triad memory bandwidth kernels. Every
+    kernel does one untimed warm-up iteration, then loopcount timed ones.
+    """
+    if isinstance(matns, int):
+        matns = [matns]
+    summary = []
+    iterations = []
+    gemm_total = {'work': 0.0, 'time': 0.0}
 
-    worker_stats = [f.stats for f in worker_futures]
-    total_time = end_time-start_time
+    def add_kernel(kernel, dtype, matn, times, work, unit):
+        times = np.array(times)
+        if kernel == 'gemm':
+            gemm_total['work'] += work * len(times)
+            gemm_total['time'] += times.sum()
+        rate = work * len(times) / times.sum()
+        summary.append({'kernel': kernel, 'dtype': dtype, 'matn': matn, 'rate': rate, 'unit': unit,
+                        'best_rate': work / times.min()})
+        iterations.extend({'kernel': kernel, 'dtype': dtype, 'matn': matn, 'iteration': i, 'time': t}
+                          for i, t in enumerate(times.tolist()))
+
+    with blas_threads_limit(blas_threads) as threads:
+        if 'gemm' in kernels:
+            for dtype in dtypes:
+                for matn in matns:
+                    add_kernel('gemm', dtype, matn, gemm_times(loopcount, matn, dtype), 2 * matn**3, 'FLOPS')
+        if 'stream' in kernels:
+            for op_name, (arrays, op) in STREAM_KERNELS.items():
+                times = stream_times(loopcount, stream_mb, op)
+                add_kernel('stream_' + op_name, 'float64', 0, times, arrays * stream_mb * 1024**2, 'B/s')
+
+    res = {'blas_threads': threads, 'kernels': summary, 'iterations': iterations}
+    res.update(worker_info())
+    # GEMM rate over all the sizes and dtypes, as est_flops counts them all
+    if gemm_total['time']:
+        res['flops'] = gemm_total['work'] / gemm_total['time']
+    return res
+
+
+def gemm_flops(loopcount, matns, dtypes):
+    """
+    FLOPs of the timed GEMM iterations of one worker
+    """
+    return loopcount * len(dtypes) * sum(2 * matn**3 for matn in matns)
+
+
+def print_kernels(results):
+    if not results:
+        print('No worker completed the benchmark')
+        return
+    print('Kernel         dtype    matn   mean/worker       min       max')
+    for i, k in enumerate(results[0]['kernels']):
+        rates = np.array([r['kernels'][i]['rate'] for r in results])
+        scale, unit = (1e9, 'GFLOPS') if k['unit'] == 'FLOPS' else (1e9, 'GB/s')
+        print('{:<14} {:<8} {:>5} {:>10.2f} {:>9.2f} {:>9.2f} {}'.format(
+            k['kernel'], k['dtype'], k['matn'] or '-', rates.mean()/scale, rates.min()/scale, rates.max()/scale, unit))
+    for label, key in [('BLAS', 'blas'), ('CPU', 'cpu_model')]:
+        counts = Counter(r[key] for r in results)
+        print('{}: {}'.format(label, ', '.join('{} ({} workers)'.format(k, v) for k, v in counts.most_common())))
+
+
+def benchmark(workers, memory, loopcount, matns, dtypes=('float64',), kernels=('gemm',), blas_threads=0,
+              stream_mb=64, res_path=None, resume=False, exc=None):
+    collector = RunCollector(res_path, resume)
+    # a resumed run keeps the parameters it was started with
+    params = collector.run_params({'loopcount': loopcount,
+                                   'workers': workers,
+                                   'memory': memory,
+                                   'matns': list(matns),
+                                   'dtypes': list(dtypes),
+                                   'kernels': list(kernels),
+                                   'blas_threads': blas_threads,
+                                   'stream_mb': stream_mb})
+    loopcount, workers, memory, matns, dtypes, kernels, blas_threads, stream_mb = \
+        [params[k] for k in ('loopcount', 'workers', 'memory', 'matns', 'dtypes', 'kernels', 'blas_threads',
+                             'stream_mb')]
+
+    iterable = [(loopcount, list(matns), list(dtypes), list(kernels), blas_threads, stream_mb)
+                for i in range(workers)]
+    worker_flops = gemm_flops(loopcount, matns, dtypes) if 'gemm' in kernels else 0
+    est_flops = workers * worker_flops
+
+    exc = exc or get_executor(runtime_memory=memory)
+    res = collector.map(exc, compute_flops, iterable,
+                        meta=dict(params, est_flops=est_flops, MATN=matns[0]),
+                        quantity=lambda r: worker_flops / 1e9, unit='GFLOPS')
+    total_time = res['total_time']
 
     print("Total time:", round(total_time, 3))
-    est_flops = workers * 2 * loopcount * matn ** 3
-    print('Estimated GFLOPS:', round(est_flops / 1e9 / total_time, 4))
+    if est_flops:
+        print('Estimated GFLOPS:', round(est_flops / 1e9 / total_time, 4))
+    print_kernels(res['results'])
+    print_cost(res)
+
+    return res
+
+
+def memory_sweep(workers, memories, loopcount, matns, dtypes, kernels, blas_threads, stream_mb, outdir, name,
+                 resume=False):
+    """
+    Runs the benchmark once per memory tier, each saved as
+    {name}_{memory}MB, and finds the tier with the most GFLOPS per dollar
+    """
+    pricing = load_pricing()
+    tiers = []
+    for memory in memories:
+        print('Memory tier: {} MB'.format(memory))
+        tier_name = '{}_{}MB'.format(name, memory)
+        res = benchmark(workers, memory, loopcount, matns, dtypes, kernels, blas_threads, stream_mb,
+                        '{}/{}'.format(outdir, tier_name), resume)
+        create_plots(res, outdir, tier_name)
+        cost = run_cost(res, pricing) or {}
+        tiers.append({'memory': memory,
+                      'total_time': res['total_time'],
+                      'worker_gflops': float(np.mean([r['flops'] for r in res['results']])) / 1e9,
+                      'cost': cost.get('cost'),
+                      'gflops_per_dollar': cost.get('gflops_per_dollar')})
 
-    res = {'start_time': start_time,
-           'total_time': total_time,
-           'est_flops': est_flops,
-           'worker_stats': worker_stats,
-           'results': results}
+    priced = [t for t in tiers if t['gflops_per_dollar']]
+    best = max(priced, key=lambda t: t['gflops_per_dollar']) if priced else None
+    print('Memory (MB)  GFLOPS/worker  Cost ({})  GFLOPS per dollar'.format(pricing['currency']))
+    for t in tiers:
+        print('{:>11} {:>14.2f} {:>11} {:>18}{}'.format(
+            t['memory'], t['worker_gflops'],
+            '-' if t['cost'] is None else '{:.6f}'.format(t['cost']),
+            '-' if t['gflops_per_dollar'] is None else '{:.1f}'.format(t['gflops_per_dollar']),
+            '  <- best' if t is best else ''))
 
+    res = {'workers': workers, 'memories': list(memories), 'tiers': tiers,
+           'best_memory': best['memory'] if best else None}
+    save_results(res, '{}/{}_memory'.format(outdir, name))
     return res
 
 
 def create_plots(data, outdir, name):
+    # plots pulls in matplotlib, pandas and seaborn: only the client imports it
+    from plots import create_execution_histogram, create_rates_histogram, create_total_gflops_plot
     create_execution_histogram(data, "{}/{}_execution.png".format(outdir, name))
-    create_rates_histogram(data, "{}/{}_rates.png".format(outdir, name))
-    create_total_gflops_plot(data, "{}/{}_gflops.png".format(outdir, name))
+    if data.get('est_flops'):
+        create_rates_histogram(data, "{}/{}_rates.png".format(outdir, name))
+        create_total_gflops_plot(data, "{}/{}_gflops.png".format(outdir, name))
 
 
 @click.command()
 @click.option('--workers', default=10, help='how many workers', type=int)
-@click.option('--memory', default=1024, help='Memory per worker in MB', type=int)
+@click.option('--memory', default=[1024], multiple=True, help='Memory per worker in MB, can be repeated to sweep memory tiers', type=int)
 @click.option('--outdir', default='.', help='dir to save results in')
 @click.option('--name', default='flops_benchmark', help='filename to save results in')
-@click.option('--loopcount', default=6, help='Number of matmuls to do.', type=int)
-@click.option('--matn', default=1024, help='size of matrix', type=int)
-def run_benchmark(workers, memory, outdir, name, loopcount, matn):
+@click.option('--loopcount', default=6, help='Number of timed iterations of each kernel.', type=int)
+@click.option('--matn', default=[1024], multiple=True, help='size of matrix, can be repeated to sweep sizes', type=int)
+@click.option('--dtype', default=['float64'], multiple=True, type=click.Choice(DTYPES), help='GEMM dtype, can be repeated')
+@click.option('--kernel', default=['gemm'], multiple=True, type=click.Choice(KERNELS), help='kernel to run, can be repeated')
+@click.option('--blas_threads', default=0, help='BLAS threads per worker, 0 for the backend default', type=int)
+@click.option('--stream_mb', default=64, help='MB of each STREAM array', type=int)
+@click.option('--resume', is_flag=True, help='only run the workers missing from a previous, interrupted run')
+@local_options
+def run_benchmark(workers, memory, outdir, name, loopcount, matn, dtype, kernel, blas_threads, stream_mb, resume):
+    if len(memory) > 1:
+        if 'gemm' not in kernel:
+            raise ValueError('The memory tier sweep compares the GEMM GFLOPS, run it with --kernel=gemm')
+        if True:
+            res = memory_sweep(workers, sorted(memory), loopcount, matn, dtype, kernel, blas_threads, stream_mb,
+                               outdir, name, resume)
+        else:
+            res = load_results('{}/{}_memory'.format(outdir, name))
+        from plots import create_memory_cost_plot
+        create_memory_cost_plot(res, '{}/{}_memory.png'.format(outdir, name))
+        return
     if True:
-        res = benchmark(workers, memory, loopcount, matn)
-        res['loopcount'] = loopcount
-        res['workers'] = workers
-        res['MATN'] = matn
-        pickle.dump(res, open('{}/{}.pickle'.format(outdir, name), 'wb'))
+        res = benchmark(workers, memory[0], loopcount, matn, dtype, kernel, blas_threads, stream_mb,
+                        '{}/{}'.format(outdir, name), resume)
     else:
-        res = pickle.load(open('{}/{}.pickle'.format(outdir, name), 'rb'))
+        res = load_results('{}/{}'.format(outdir, name))
     create_plots(res, outdir, name)
 
 
@@ -15,6 +15,7 @@
 #
 
 import os
+import sys
 import pylab
 import logging
 import numpy as np
@@ -22,19 +23,24 @@ import pandas as pd
 import seaborn as sns
 from matplotlib.collections import LineCollection
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.timeline import time_bins, in_flight, sweep, segments
+from common.clock import STATS_KEYS, corrected
+
 pylab.switch_backend("Agg")
 logger = logging.getLogger(__name__)
 
 
-def create_execution_histogram(benchmark_data, dst):
+def create_execution_histogram(benchmark_data, dst, bin_size=1.0):
     start_time = benchmark_data['start_time']
-    time_rates = [(f['worker_start_tstamp'], f['worker_end_tstamp']) for f in benchmark_data['worker_stats']]
+    time_rates = [(corrected(f, 'worker_start_tstamp'), corrected(f, 'worker_end_tstamp'))
+                  for f in benchmark_data['worker_stats']]
     total_calls = len(time_rates)
 
     max_seconds = int(max([tr[1]-start_time for tr in time_rates])*1.1)
     max_seconds = 8 * round(max_seconds/8)
 
-    runtime_bins = np.linspace(0, max_seconds, max_seconds)
+    runtime_bins = time_bins(max_seconds, bin_size)
 
     def compute_times_rates(time_rates):
         x = np.array(time_rates)
@@ -42,34 +48,21 @@ def create_execution_histogram(benchmark_data, dst):
         tr_start_time = x[:, 0] - tzero
         tr_end_time = x[:, 1] - tzero
 
-        N = len(tr_start_time)
-
-        runtime_calls_hist = np.zeros((N, len(runtime_bins)))
-
-        for i in range(N):
-            s = tr_start_time[i]
-            e = tr_end_time[i]
-            a, b = np.searchsorted(runtime_bins, [s, e])
-            if b-a > 0:
-                runtime_calls_hist[i, a:b] = 1
-
         return {'start_time': tr_start_time,
                 'end_time': tr_end_time,
-                'runtime_calls_hist': runtime_calls_hist}
+                'runtime_calls': in_flight(runtime_bins, tr_start_time, tr_end_time)}
 
     fig = pylab.figure(figsize=(5, 5))
     ax = fig.add_subplot(1, 1, 1)
 
     time_hist = compute_times_rates(time_rates)
 
-    N = len(time_hist['start_time'])
-    line_segments = LineCollection([[[time_hist['start_time'][i], i],
-                                     [time_hist['end_time'][i], i]] for i in range(N)],
+    line_segments = LineCollection(segments(time_hist['start_time'], time_hist['end_time']),
                                    linestyles='solid', color='k', alpha=0.6, linewidth=0.4)
 
     ax.add_collection(line_segments)
 
-    ax.plot(runtime_bins, time_hist['runtime_calls_hist'].sum(axis=0), label='Parallel Functions', zorder=-1)
+    ax.plot(runtime_bins, time_hist['runtime_calls'], label='Parallel Functions', zorder=-1)
 
     yplot_step = int(np.max([1, total_calls/20]))
     y_ticks = np.arange(total_calls//yplot_step + 2) * yplot_step
@@ -121,22 +114,18 @@ def create_rates_histogram(benchmark_data, dst):
     fig.savefig(dst)
 
 
-def create_total_gflops_plot(benchmark_data, dst):
+def create_total_gflops_plot(benchmark_data, dst, bin_size=1.0):
     tzero = benchmark_data['start_time']
-    data_df = pd.DataFrame(benchmark_data['worker_stats'])
+    data_df = pd.DataFrame([{key: corrected(f, key) for key in STATS_KEYS} for f in benchmark_data['worker_stats']])
     data_df['est_flops'] = benchmark_data['est_flops'] / benchmark_data['workers']
 
     max_time = np.max(data_df.worker_end_tstamp) - tzero
-    runtime_bins = np.linspace(0, int(max_time), int(max_time), endpoint=False)
-    runtime_flops_hist = np.zeros((len(data_df), len(runtime_bins)))
-
-    for i in range(len(data_df)):
-        row = data_df.iloc[i]
-        s = row.worker_func_start_tstamp - tzero
-        e = row.worker_func_end_tstamp - tzero
-        a, b = np.searchsorted(runtime_bins, [s, e])
-        if b-a > 0:
-            runtime_flops_hist[i, a:b] = row.est_flops / float(b-a)
+    runtime_bins = time_bins(int(max_time), bin_size, endpoint=False)
+    # flops per bin, spread evenly over the bins each worker was computing
+    runtime_flops = sweep(runtime_bins,
+                          data_df.worker_func_start_tstamp.values - tzero,
+                          data_df.worker_func_end_tstamp.values - tzero,
+                          data_df.est_flops.values, spread=True)
 
     results_by_endtime = data_df.sort_values('worker_end_tstamp')
     results_by_endtime['job_endtime_zeroed'] = data_df.worker_end_tstamp - tzero
@@ -146,7 +135,7 @@ def create_total_gflops_plot(benchmark_data, dst):
     fig = pylab.figure(figsize=(5, 5))
     ax = fig.add_subplot(1, 1, 1)
 
-    ax.plot(runtime_flops_hist.sum(axis=0)/1e9, label='Peak GFLOPS')
+    ax.plot(runtime_bins, runtime_flops/bin_size/1e9, label='Peak GFLOPS')
     ax.plot(results_by_endtime.job_endtime_zeroed, results_by_endtime.rolling_flops_rate/1e9, label='Effective GFLOPS')
     ax.set_xlabel('Execution Time (sec)')
     ax.set_ylabel("GFLOPS")
@@ -159,3 +148,82 @@ def create_total_gflops_plot(benchmark_data, dst):
 
     fig.tight_layout()
     fig.savefig(dst)
+
+
+def create_dgemm_scaling_plot(res, dst):
+    """
+    Effective GFLOPS of the distributed GEMM, including I/O and
+    invocation, against its compute-only GFLOPS as workers grow, and the
+    mean fetch/compute/write time of a worker
+    """
+    scaling = res['scaling']
+    workers = [p['workers'] for p in scaling]
+
+    fig, axes = pylab.subplots(nrows=1, ncols=2, figsize=(10, 4))
+
+    ax = axes[0]
+    ax.plot(workers, [p['compute_gflops'] for p in scaling], marker='o', label='Compute only')
+    ax.plot(workers, [p['effective_gflops'] for p in scaling], marker='o', label='Effective (with I/O)')
+    incomplete = [p for p in scaling if p.get('missing_tiles')]
+    if incomplete:
+        ax.scatter([p['workers'] for p in incomplete], [p['effective_gflops'] for p in incomplete],
+                   marker='x', s=80, color='red', zorder=3, label='Missing tiles')
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel('Workers')
+    ax.set_ylabel('GFLOPS')
+    ax.set_title('{0}x{0} {1} GEMM'.format(res['matn'], res['dtype']), fontsize=10)
+    ax.grid(True)
+    ax.legend()
+
+    ax = axes[1]
+    x = np.arange(len(workers))
+    bottom = np.zeros(len(workers))
+    for i, stage in enumerate(['fetch', 'compute', 'write']):
+        t = np.array([p['{}_time'.format(stage)] for p in scaling])
+        ax.bar(x, t, bottom=bottom, label=stage.capitalize(), color='C{}'.format(i), ec='black')
+        bottom += t
+    ax.set_xticks(x)
+    ax.set_xticklabels(workers)
+    ax.set_xlabel('Workers')
+    ax.set_ylabel('Mean time per worker (sec)')
+    ax.yaxis.grid(True)
+    ax.legend()
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
+
+
+def create_memory_cost_plot(res, dst):
+    """
+    Mean GFLOPS of a worker and GFLOPS per dollar of every memory tier,
+    the most cost efficient tier highlighted
+    """
+    tiers = res['tiers']
+    x = np.arange(len(tiers))
+    labels = [t['memory'] for t in tiers]
+
+    fig, axes = pylab.subplots(nrows=1, ncols=2, figsize=(10, 4))
+
+    ax = axes[0]
+    ax.bar(x, [t['worker_gflops'] for t in tiers], color='C0', ec='black')
+    ax.set_ylabel('Mean GFLOPS per worker')
+
+    ax = axes[1]
+    colors = ['C1' if t['memory'] == res['best_memory'] else 'C0' for t in tiers]
+    ax.bar(x, [t['gflops_per_dollar'] or 0 for t in tiers], color=colors, ec='black')
+    ax.set_ylabel('GFLOPS per dollar')
+
+    for ax in axes:
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels)
+        ax.set_xlabel('Memory per worker (MB)')
+        ax.yaxis.grid(True)
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
@@ -0,0 +1,139 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import time
+import click
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.store import ResultStore, load_results
+from common.local import get_executor, local_options
+from common.clock import correct_clocks, corrected, print_offsets
+
+# (name, start stat, end stat) of the phases of a call
+PHASES = [('submit_to_worker_start', 'host_submit_tstamp', 'worker_start_tstamp'),
+          ('worker_start_to_func_start', 'worker_start_tstamp', 'worker_func_start_tstamp'),
+          ('func', 'worker_func_start_tstamp', 'worker_func_end_tstamp'),
+          ('func_end_to_done', 'worker_func_end_tstamp', 'host_status_done_tstamp')]
+
+
+def noop(fanout, wave, call):
+    return {'fanout': fanout, 'wave': wave, 'call': call}
+
+
+def call_phases(stats, result):
+    """
+    Splits a call into the PHASES, and labels it cold or warm. Lithops
+    versions that do not report worker_cold_start are labeled by wave:
+    the first wave of each fan-out is cold, the rest are warm. Worker
+    timestamps are taken on the client clock if they were corrected.
+    """
+    phases = {name: corrected(stats, end) - corrected(stats, start) for name, start, end in PHASES
+              if start in stats and end in stats}
+    if 'host_status_done_tstamp' in stats:
+        phases['total'] = stats['host_status_done_tstamp'] - stats['host_submit_tstamp']
+    else:
+        phases['total'] = corrected(stats, 'worker_end_tstamp') - stats['host_submit_tstamp']
+    if 'worker_cold_start' in stats:
+        phases['cold'] = bool(stats['worker_cold_start'])
+    else:
+        phases['cold'] = result['wave'] == 0
+    return phases
+
+
+def print_phases(results):
+    for label, cold in [('Cold', True), ('Warm', False)]:
+        calls = [r for r in results if r['cold'] == cold]
+        if not calls:
+            continue
+        print('{} calls: {}'.format(label, len(calls)))
+        for name in [p[0] for p in PHASES] + ['total']:
+            x = np.array([r[name] for r in calls if name in r])
+            if len(x):
+                print('  {:<28} p50/p90/p99: {:7.3f} {:7.3f} {:7.3f} s'.format(name, *np.percentile(x, [50, 90, 99])))
+
+
+def invoke(fanouts, waves, memory, pause, res_path=None):
+    """
+    Fires waves of no-op calls through one executor, so that later waves
+    can reuse the containers started by the first one
+    """
+    exc = get_executor(runtime_memory=memory)
+    store = ResultStore(res_path, 'w') if res_path else None
+    backend = getattr(exc, 'backend', None)
+
+    start_time = time.time()
+    worker_stats = []
+    results = []
+    offsets = []
+    for fanout in fanouts:
+        for wave in range(waves):
+            if wave > 0 and pause:
+                time.sleep(pause)
+            futures = exc.map(noop, [(fanout, wave, call) for call in range(fanout)])
+            wave_results = exc.get_result(futures)
+            wave_stats = [f.stats for f in futures]
+            wave_offsets = correct_clocks({'worker_stats': wave_stats, 'results': wave_results})
+            if wave_offsets is not None:
+                offsets.extend(wave_offsets)
+            wave_results = [dict(r, **call_phases(s, r)) for s, r in zip(wave_stats, wave_results)]
+            cold = sum(r['cold'] for r in wave_results)
+            print('Fan-out {} - wave {}: {} cold / {} warm calls'.format(fanout, wave, cold, fanout - cold))
+
+            if store is not None:
+                store.append_workers(range(len(results), len(results) + fanout), wave_stats, wave_results)
+            worker_stats.extend(wave_stats)
+            results.extend(wave_results)
+    end_time = time.time()
+
+    print_offsets(np.array(offsets) if offsets else None)
+    print_phases(results)
+
+    res = {'start_time': start_time,
+           'total_time': end_time - start_time,
+           'backend': backend,
+           'memory': memory,
+           'fanouts': list(fanouts),
+           'waves': waves,
+           'pause': pause}
+    if store is not None:
+        store.update_meta(res)
+    res.update({'worker_stats': worker_stats, 'results': results})
+
+    return res
+
+
+@click.command()
+@click.option('--fanout', default=[100], multiple=True, help='calls per wave, can be repeated', type=int)
+@click.option('--waves', default=3, help='waves per fan-out, the first one is usually cold', type=int)
+@click.option('--memory', default=256, help='Memory per worker in MB', type=int)
+@click.option('--pause', default=5, help='seconds to wait between waves', type=float)
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='invoke_benchmark', help='filename to save results in')
+@local_options
+def run_benchmark(fanout, waves, memory, pause, outdir, name):
+    if True:
+        res = invoke(fanout, waves, memory, pause, '{}/{}'.format(outdir, name))
+    else:
+        res = load_results('{}/{}'.format(outdir, name))
+    from plots import create_phases_plot
+    create_phases_plot(res, '{}/{}_phases.png'.format(outdir, name))
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,72 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import pylab
+import logging
+import numpy as np
+import pandas as pd
+
+pylab.switch_backend("Agg")
+logger = logging.getLogger(__name__)
+
+PHASE_LABELS = [('submit_to_worker_start', 'Submit to worker start'),
+                ('worker_start_to_func_start', 'Worker start to function start'),
+                ('func', 'Function'),
+                ('func_end_to_done', 'Function end to done')]
+COLD_COLOR = (0.12156862745098039, 0.4666666666666667, 0.7058823529411765)
+WARM_COLOR = (1.0, 0.4980392156862745, 0.054901960784313725)
+
+
+def create_phases_plot(res, dst):
+    """
+    Median duration of every phase of a call, for cold and warm calls,
+    and the CDF of the submit to function start latency
+    """
+    results_df = pd.DataFrame(res['results'])
+
+    fig, axes = pylab.subplots(nrows=1, ncols=2, figsize=(10, 5))
+
+    ax = axes[0]
+    groups = [(label, results_df[results_df.cold == cold]) for label, cold in [('Cold', True), ('Warm', False)]]
+    groups = [(label, df) for label, df in groups if len(df)]
+    left = np.zeros(len(groups))
+    for i, (phase, label) in enumerate(PHASE_LABELS):
+        if phase not in results_df:
+            continue
+        medians = np.array([df[phase].median() for unused, df in groups])
+        ax.barh(np.arange(len(groups)), medians, left=left, label=label, color='C{}'.format(i), ec='black')
+        left += medians
+    ax.set_yticks(np.arange(len(groups)))
+    ax.set_yticklabels(['{} ({} calls)'.format(label, len(df)) for label, df in groups])
+    ax.set_xlabel('Median time (sec)')
+    ax.legend(loc='upper right', fontsize=8)
+    ax.xaxis.grid(True)
+
+    ax = axes[1]
+    for (label, df), c in zip(groups, [COLD_COLOR, WARM_COLOR]):
+        startup = np.sort((df.submit_to_worker_start + df.worker_start_to_func_start).values)
+        ax.plot(startup, np.arange(1, len(startup)+1) / len(startup), label='{} calls'.format(label), c=c)
+    ax.set_xlabel('Submit to function start (sec)')
+    ax.set_ylabel('Fraction of calls')
+    ax.legend(loc='lower right')
+    ax.grid(True)
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
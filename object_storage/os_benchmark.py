@@ -17,201 +17,1237 @@
 import uuid
 import numpy as np
 import time
+import zlib
+import queue
+import random
+import asyncio
 import hashlib
-import pickle
+import os
+import sys
 import click
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from lithops.executor import FunctionExecutor
-from plots import create_execution_histogram, create_rates_histogram, create_agg_bdwth_plot
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.store import save_results, load_results
+from common.collect import RunCollector
+from common.payload import RandomDataGenerator
+from common.local import get_executor, local_options
+from common.pricing import print_cost
+from common.clock import corrected
 
+# memory of the workers in MB, also used to compute the cost of the runs
+RUNTIME_MEMORY = 1024
 
-class RandomDataGenerator(object):
+
+class ThroughputSampler(object):
+    """
+    Counts the bytes moved by a worker in consecutive intervals of
+    interval seconds from start_time, a compact time series of its
+    throughput. Thread-safe.
     """
-    A file-like object which generates random data.
-    1. Never actually keeps all the data in memory so
-    can be used to generate huge files.
-    2. Actually generates random data to eliminate
-    false metrics based on compression.
 
-    It does this by generating data in 1MB blocks
-    from np.random where each block is seeded with
-    the block number.
+    def __init__(self, start_time, interval=0.1):
+        self.start_time = start_time
+        self.interval = interval
+        self.samples = [0]
+        self.lock = threading.Lock()
+
+    def add(self, bytes_n):
+        i = int((time.time() - self.start_time) / self.interval)
+        with self.lock:
+            if i >= len(self.samples):
+                self.samples.extend([0] * (i + 1 - len(self.samples)))
+            self.samples[i] += bytes_n
+
+    def attempt(self):
+        """
+        Sampler of one request attempt, added to this one with merge()
+        only if the attempt succeeds, so that the bytes sent by failed or
+        throttled attempts are not counted
+        """
+        return ThroughputSampler(self.start_time, self.interval)
+
+    def merge(self, other):
+        with other.lock:
+            samples = list(other.samples)
+        with self.lock:
+            if len(samples) > len(self.samples):
+                self.samples.extend([0] * (len(samples) - len(self.samples)))
+            for i, bytes_n in enumerate(samples):
+                self.samples[i] += bytes_n
+
+    def array(self):
+        with self.lock:
+            return np.array(self.samples, dtype=np.int64)
+
+
+INTEGRITY_CHECKS = ['none', 'crc32', 'adler32', 'xxh64', 'md5']
+
+
+class ZlibChecksum(object):
     """
+    hashlib-like wrapper around the zlib running checksums
+    """
+
+    def __init__(self, func, value):
+        self.func = func
+        self.value = value
 
-    def __init__(self, bytes_total):
-        self.bytes_total = bytes_total
-        self.pos = 0
-        self.current_block_id = None
-        self.current_block_data = ""
-        self.BLOCK_SIZE_BYTES = 1024*1024
-        self.block_random = np.random.randint(0, 256, dtype=np.uint8,
-                                              size=self.BLOCK_SIZE_BYTES)
+    def update(self, data):
+        self.value = self.func(data, self.value)
 
-    def __len__(self):
-        return self.bytes_total
+    def hexdigest(self):
+        return '{:08x}'.format(self.value & 0xffffffff)
+
+
+def new_checksum(integrity):
+    if integrity == 'md5':
+        return hashlib.md5()
+    if integrity == 'crc32':
+        return ZlibChecksum(zlib.crc32, 0)
+    if integrity == 'adler32':
+        return ZlibChecksum(zlib.adler32, 1)
+    if integrity == 'xxh64':
+        import xxhash
+        return xxhash.xxh64()
+    if integrity == 'none':
+        return None
+    raise ValueError('Unknown integrity check: {}'.format(integrity))
+
+
+class IntegrityChecker(object):
+    """
+    Hashes the blocks received by a reader, either inline or on a
+    background thread that overlaps with the network reads. The time
+    spent hashing is accumulated in hash_time.
+    """
+
+    def __init__(self, integrity, threaded=False, queue_size=16):
+        self.checksum = new_checksum(integrity)
+        self.hash_time = 0
+        self.thread = None
+        if self.checksum is not None and threaded:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _hash(self, data):
+        t0 = time.time()
+        self.checksum.update(data)
+        self.hash_time += time.time() - t0
+
+    def _run(self):
+        data = self.queue.get()
+        while data is not None:
+            self._hash(data)
+            data = self.queue.get()
 
     @property
-    def len(self):
-        return self.bytes_total 
+    def threaded(self):
+        return self.thread is not None
+
+    def update(self, data):
+        if self.checksum is None:
+            return
+        if self.thread is not None:
+            self.queue.put(data)
+        else:
+            self._hash(data)
+
+    def hexdigest(self):
+        """
+        Waits for the pending blocks to be hashed and returns the digest
+        """
+        if self.checksum is None:
+            return None
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        return self.checksum.hexdigest()
+
+
+THROTTLE_CODES = ['SlowDown', 'Throttling', 'ThrottlingException', 'TooManyRequests',
+                  'RequestLimitExceeded', 'ServiceUnavailable', 'ServerBusy']
+
+
+def is_throttle_error(e):
+    """
+    Tells throttling errors (HTTP 429/503, SlowDown...) from other errors
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        if response.get('Error', {}).get('Code') in THROTTLE_CODES:
+            return True
+        if response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (429, 503):
+            return True
+    for attr in ('status_code', 'code', 'status'):
+        if getattr(e, attr, None) in (429, 503):
+            return True
+    return any(code in str(e) for code in THROTTLE_CODES)
+
+
+class Retrier(object):
+    """
+    Calls storage requests, retrying failed ones up to retries times with
+    jittered exponential backoff. Counts throttling and other errors, and
+    is thread-safe so the threads of a worker can share it.
+    """
 
-    def tell(self):
-        return self.pos
+    def __init__(self, retries=0, backoff=0.1):
+        self.retries = retries
+        self.backoff = backoff
+        self.throttled = 0
+        self.errors = 0
+        self.lock = threading.Lock()
 
-    def seek(self, pos, whence=0):
-        if whence == 0:
-            self.pos = pos
-        elif whence == 1:
-            self.pos += pos
-        elif whence == 2:
-            self.pos = self.bytes_total - pos
+    def record(self, e):
+        with self.lock:
+            if is_throttle_error(e):
+                self.throttled += 1
+            else:
+                self.errors += 1
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                self.record(e)
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1))
+                attempt += 1
 
-    def get_block(self, block_id):
-        if block_id == self.current_block_id:
-            return self.current_block_data
+    def stats(self):
+        return {'throttled': self.throttled, 'errors': self.errors}
 
-        self.current_block_id = block_id
-        self.current_block_data = (block_id + self.block_random).tostring()
-        return self.current_block_data
 
-    def get_block_coords(self, abs_pos):
-        block_id = abs_pos // self.BLOCK_SIZE_BYTES
-        within_block_pos = abs_pos - block_id * self.BLOCK_SIZE_BYTES
-        return block_id, within_block_pos
+REQUEST_COLUMNS = ['issued', 'first_byte', 'last_byte']
+LATENCY_PERCENTILES = [50, 90, 99, 99.9]
 
-    def read(self, bytes_requested):
-        remaining_bytes = self.bytes_total - self.pos
-        if remaining_bytes == 0:
-            return b''
 
-        bytes_out = min(remaining_bytes, bytes_requested)
-        start_pos = self.pos
+def request_times(rows):
+    """
+    Packs (issued, first_byte, last_byte) timestamps of the requests
+    made by a worker into a compact (n, 3) float64 array
+    """
+    return np.array(rows, dtype=np.float64).reshape(-1, len(REQUEST_COLUMNS))
 
-        byte_data = b''
-        byte_pos = 0
-        while byte_pos < bytes_out:
-            abs_pos = start_pos + byte_pos
-            bytes_remaining = bytes_out - byte_pos
 
-            block_id, within_block_pos = self.get_block_coords(abs_pos)
-            block = self.get_block(block_id)
-            # how many bytes can we copy?
-            chunk = block[within_block_pos:within_block_pos + bytes_remaining]
+def request_latencies(results):
+    """
+    Returns the TTFB and full request latencies of all the requests
+    recorded in a list of worker results
+    """
+    requests = [r['requests'] for r in results if 'requests' in r]
+    if not requests:
+        return np.empty(0), np.empty(0)
+    x = np.concatenate(requests)
+    return x[:, 1] - x[:, 0], x[:, 2] - x[:, 0]
 
-            byte_data += chunk
 
-            byte_pos += len(chunk)
+def print_latency_percentiles(label, results):
+    ttfb, latency = request_latencies(results)
+    if len(latency) == 0:
+        return
+    print('{} requests: {}'.format(label, len(latency)))
+    for p in LATENCY_PERCENTILES:
+        print('  p{:<5} TTFB: {:8.3f} s - Request: {:8.3f} s'.format(p, np.percentile(ttfb, p),
+                                                                      np.percentile(latency, p)))
 
-        self.pos += bytes_out
 
-        return byte_data
+def print_retry_stats(label, results):
+    throttled = sum(r.get('throttled', 0) for r in results)
+    errors = sum(r.get('errors', 0) for r in results)
+    if throttled or errors:
+        print('{} failed attempts: {} throttled - {} other errors'.format(label, throttled, errors))
 
 
 runtime_bins = np.linspace(0, 50, 50)
 
 
-def write(bucket_name, mb_per_file, number, key_prefix):
+KEY_LAYOUTS = ['random', 'sequential', 'hashed', 'date']
+
+
+def make_keynames(key_layout, number, key_prefix, prefixes=16):
+    """
+    Names number objects under key_prefix following key_layout:
+    random: a random hex key per object (the default)
+    sequential: increasing keys under a single run prefix
+    hashed: sequential keys spread over a number of hashed prefixes
+    date: time-partitioned keys under a year=/month=/day=/hour= prefix
+    """
+    if key_layout == 'random':
+        return [key_prefix + str(uuid.uuid4().hex.upper()) for unused in range(number)]
+    run_id = uuid.uuid4().hex[:8].upper()
+    if key_layout == 'sequential':
+        return ['{}{}/{:08d}'.format(key_prefix, run_id, i) for i in range(number)]
+    if key_layout == 'hashed':
+        width = len('{:x}'.format(max(prefixes - 1, 1)))
+        shards = [int(hashlib.md5(str(i).encode()).hexdigest(), 16) % prefixes for i in range(number)]
+        return ['{}{:0{}x}/{}/{:08d}'.format(key_prefix, shard, width, run_id, i) for i, shard in enumerate(shards)]
+    partition = time.strftime('year=%Y/month=%m/day=%d/hour=%H', time.gmtime())
+    return ['{}{}/part-{:08d}-{}'.format(key_prefix, partition, i, run_id) for i in range(number)]
+
+
+# S3 multipart upload limits: every part but the last one must be at
+# least 5 MiB, and an upload has at most 10000 parts
+MIN_PART_SIZE = 5 * 1024**2
+MAX_PARTS = 10000
+
+
+def get_part_size(mb_per_file, parts, part_size_mb):
+    """
+    Returns the multipart part size in bytes, or 0 for a single PUT
+    """
+    if parts and part_size_mb:
+        raise ValueError('Use either --parts or --part_size_mb, not both')
+    if parts and parts > 1 and mb_per_file is None:
+        raise ValueError('--parts needs the object size within --mb_per_file parameter')
+    if part_size_mb:
+        return part_size_mb * 1024**2
+    if parts and parts > 1:
+        return -(-mb_per_file * 1024**2 // parts)
+    return 0
+
+
+def check_multipart(storage, part_size, bytes_n):
+    """
+    Checks, before the workers are started, that the storage supports
+    multipart uploads and that part_size fits the S3 limits for objects
+    of bytes_n bytes
+    """
+    if not hasattr(storage.get_client(), 'create_multipart_upload'):
+        raise NotImplementedError('Multipart upload requires an S3-compatible storage backend')
+    if part_size < MIN_PART_SIZE and part_size < bytes_n:
+        raise ValueError('Multipart parts must be at least {} MiB, got {:.2f} MiB'.format(
+            MIN_PART_SIZE // 1024**2, part_size / 1024**2))
+    if -(-bytes_n // part_size) > MAX_PARTS:
+        raise ValueError('Multipart uploads have at most {} parts, use larger parts'.format(MAX_PARTS))
+
+
+def multipart_upload(storage, bucket_name, key_name, data, part_size, upload_threads, retrier=None, sampler=None):
+    """
+    Uploads data as a multipart upload, sending its parts concurrently
+    from a thread pool. Requires an S3-compatible storage client (see
+    check_multipart). The upload is aborted if any step after its
+    creation fails. The bytes of the parts that were uploaded are added
+    to sampler, if any. Returns the per-part timings.
+    """
+    client = storage.get_client()
+    retrier = retrier or Retrier()
+    mpu = retrier.call(client.create_multipart_upload, Bucket=bucket_name, Key=key_name)
+    upload_id = mpu['UploadId']
+
+    def upload_part(part_number):
+        offset = (part_number - 1) * part_size
+        bytes_n = min(part_size, len(data) - offset)
+        bodies = []
+
+        def send():
+            # a retried attempt needs a fresh, unread body
+            bodies.append(data.part(offset, bytes_n))
+            bodies[-1].sampler = sampler.attempt() if sampler is not None else None
+            resp = client.upload_part(Bucket=bucket_name, Key=key_name, UploadId=upload_id,
+                                      PartNumber=part_number, Body=bodies[-1])
+            if sampler is not None:
+                sampler.merge(bodies[-1].sampler)
+            return resp
+
+        start_time = time.time()
+        resp = retrier.call(send)
+        end_time = time.time()
+        body = bodies[-1]
+        return {'part_number': part_number, 'etag': resp['ETag'], 'bytes': bytes_n,
+                'start_time': start_time, 'first_byte_time': body.first_read_time or end_time,
+                'end_time': end_time, 'mb_rate': bytes_n/(end_time-start_time)/1e6}
+
+    part_numbers = range(1, -(-len(data) // part_size) + 1)
+    try:
+        with ThreadPoolExecutor(max_workers=upload_threads) as pool:
+            parts = list(pool.map(upload_part, part_numbers))
+        retrier.call(client.complete_multipart_upload, Bucket=bucket_name, Key=key_name, UploadId=upload_id,
+                     MultipartUpload={'Parts': [{'PartNumber': p['part_number'], 'ETag': p['etag']}
+                                                for p in parts]})
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket_name, Key=key_name, UploadId=upload_id)
+        raise
+
+    for p in parts:
+        del p['etag']
+
+    return parts
+
+
+def write(bucket_name, mb_per_file, number, key_prefix, part_size=0, upload_threads=1, res_path=None, resume=False,
+          retries=0, key_layout='random', key_prefixes=16, sample_interval=0.1, memory=RUNTIME_MEMORY, exc=None):
 
     def write_object(key_name, storage):
         bytes_n = mb_per_file * 1024**2
         d = RandomDataGenerator(bytes_n)
+        retrier = Retrier(retries)
+        bodies = []
         print(key_name)
+
+        def put_object():
+            # a retried attempt needs a fresh, unread body and its own samples
+            bodies.append(d.part(0, bytes_n))
+            bodies[-1].sampler = sampler.attempt()
+            storage.put_object(bucket_name, key_name, bodies[-1])
+            sampler.merge(bodies[-1].sampler)
+
         start_time = time.time()
-        storage.put_object(bucket_name, key_name, d)
+        sampler = ThroughputSampler(start_time, sample_interval)
+        if part_size:
+            parts = multipart_upload(storage, bucket_name, key_name, d, part_size, upload_threads, retrier,
+                                     sampler)
+            requests = [(p['start_time'], p['first_byte_time'], p['end_time']) for p in parts]
+        else:
+            retrier.call(put_object)
         end_time = time.time()
+        if not part_size:
+            requests = [(start_time, bodies[-1].first_read_time or end_time, end_time)]
 
         mb_rate = bytes_n/(end_time-start_time)/1e6
         print('MB Rate: '+str(mb_rate))
 
-        return {'start_time': start_time, 'end_time': end_time, 'mb_rate': mb_rate}
+        res = {'start_time': start_time, 'end_time': end_time, 'mb_rate': mb_rate, 'bytes_written': bytes_n,
+               'requests': request_times(requests), 'sample_interval': sample_interval,
+               'throughput': sampler.array()}
+        res.update(retrier.stats())
+        if part_size:
+            res['parts'] = parts
 
-    # create list of random keys
-    keynames = [key_prefix + str(uuid.uuid4().hex.upper()) for unused in range(number)]
+        return res
 
-    exc = FunctionExecutor(runtime_memory=1024)
-    start_time = time.time()
-    worker_futures = exc.map(write_object, keynames)
-    results = exc.get_result()
-    end_time = time.time()
+    collector = RunCollector(res_path, resume)
+    # a resumed run keeps the parameters and keys it was started with
+    params = collector.run_params({'bucket_name': bucket_name,
+                                   'mb_per_file': mb_per_file,
+                                   'number': number,
+                                   'key_prefix': key_prefix,
+                                   'memory': memory,
+                                   'part_size': part_size,
+                                   'upload_threads': upload_threads,
+                                   'retries': retries,
+                                   'key_layout': key_layout,
+                                   'key_prefixes': key_prefixes,
+                                   'sample_interval': sample_interval})
+    bucket_name, mb_per_file, memory, part_size, upload_threads, retries, sample_interval = \
+        [params[k] for k in ('bucket_name', 'mb_per_file', 'memory', 'part_size', 'upload_threads', 'retries',
+                             'sample_interval')]
+    if mb_per_file is None:
+        raise ValueError('You must provide the object size within --mb_per_file parameter')
+    keynames = collector.meta.get('keynames') or make_keynames(params['key_layout'], params['number'],
+                                                               params['key_prefix'], params['key_prefixes'])
 
-    worker_stats = [f.stats for f in worker_futures]
-    total_time = end_time-start_time
+    exc = exc or get_executor(runtime_memory=memory)
+    if part_size:
+        check_multipart(exc.storage, part_size, mb_per_file * 1024**2)
+    res = collector.map(exc, write_object, keynames,
+                        meta=dict(params, keynames=keynames),
+                        quantity=lambda r: mb_per_file * 1024**2 / 1e6)
+    results = res['results']
+    if not results:
+        print('No worker completed the write')
+        return res
 
-    res = {'start_time': start_time,
-           'total_time': total_time,
-           'worker_stats': worker_stats,
-           'bucket_name': bucket_name,
-           'keynames': keynames,
-           'results': results}
+    if part_size:
+        part_rates = [p['mb_rate'] for r in results for p in r['parts']]
+        print('Parts per object:', len(results[0]['parts']), '- Upload threads:', upload_threads)
+        print('Mean part MB Rate:', round(np.mean(part_rates), 2))
+    print('Mean object MB Rate:', round(np.mean([r['mb_rate'] for r in results]), 2))
+    print_latency_percentiles('Write', results)
+    print_retry_stats('Write', results)
+    print_cost(res)
 
     return res
 
 
-def read(bucket_name, number, keylist_raw, read_times):
+def get_body(storage, bucket_name, key_name, retrier, blocksize=1024*1024, extra_get_args=None,
+             cancelled=None, first_byte=None):
+    """
+    GETs an object, or a range of it, into memory. Returns the data and
+    the times its first and last bytes were received. Sets the first_byte
+    event when data starts arriving, and stops early, returning what was
+    read so far, once the cancelled event is set.
+    """
+    kwargs = {'extra_get_args': extra_get_args} if extra_get_args else {}
+    fileobj = retrier.call(storage.get_object, bucket_name, key_name, stream=True, **kwargs)
+    try:
+        # read the first byte alone, the TTFB must not include a block
+        chunks = [fileobj.read(1)]
+        first_byte_time = time.time()
+        if first_byte is not None:
+            first_byte.set()
+        while len(chunks[-1]) > 0:
+            if cancelled is not None and cancelled.is_set():
+                if hasattr(fileobj, 'close'):
+                    fileobj.close()
+                break
+            chunks.append(fileobj.read(blocksize))
+    except Exception as e:
+        retrier.record(e)
+        raise
+    return b''.join(chunks), first_byte_time, time.time()
+
+
+class Hedger(object):
+    """
+    Hedged range GETs. When a request has not produced its first byte,
+    or has not finished, within a deadline, a duplicate request is issued
+    and the first one to finish wins, the other one is cancelled.
+    Deadlines are the percentile of the TTFB and latency of the requests
+    completed so far, or the initial ones (from a previous run) until
+    MIN_SAMPLES requests have completed. Without deadlines requests are
+    not hedged. Responses are buffered in memory, so only ranges, whose
+    size bounds that memory, are hedged.
+    """
+
+    MIN_SAMPLES = 10
+
+    def __init__(self, percentile, ttfb=None, latency=None, blocksize=1024*1024):
+        self.percentile = percentile
+        self.initial = (ttfb, latency)
+        self.blocksize = blocksize
+        self.ttfb_samples = deque(maxlen=1000)
+        self.latency_samples = deque(maxlen=1000)
+        self.hedges = 0
+        self.hedges_won = 0
+        self.wasted_bytes = 0
+        self.lock = threading.Lock()
+
+    def deadlines(self):
+        with self.lock:
+            if len(self.latency_samples) >= self.MIN_SAMPLES:
+                return (np.percentile(self.ttfb_samples, self.percentile),
+                        np.percentile(self.latency_samples, self.percentile))
+        return self.initial
+
+    def start(self, storage, bucket_name, key_name, retrier, extra_get_args, any_done):
+        attempt = {'start_time': time.time(), 'first_byte': threading.Event(), 'done': threading.Event(),
+                   'cancelled': threading.Event(), 'result': None, 'error': None}
+
+        def run():
+            try:
+                result = get_body(storage, bucket_name, key_name, retrier, self.blocksize, extra_get_args,
+                                  attempt['cancelled'], attempt['first_byte'])
+                with self.lock:
+                    attempt['result'] = result
+                    if attempt['cancelled'].is_set():
+                        self.wasted_bytes += len(result[0])
+                    else:
+                        self.ttfb_samples.append(result[1] - attempt['start_time'])
+                        self.latency_samples.append(result[2] - attempt['start_time'])
+            except Exception as e:
+                attempt['error'] = e
+            attempt['done'].set()
+            any_done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return attempt
+
+    def get(self, storage, bucket_name, key_name, retrier, extra_get_args=None):
+        """
+        Returns the data and the issue, first byte and last byte times of
+        a hedged GET of a range of an object
+        """
+        ttfb_deadline, deadline = self.deadlines()
+        any_done = threading.Event()
+        issued_time = time.time()
+        primary = self.start(storage, bucket_name, key_name, retrier, extra_get_args, any_done)
+        attempts = [primary]
+
+        if deadline is not None:
+            late = not primary['first_byte'].wait(ttfb_deadline)
+            if not late:
+                late = not primary['done'].wait(max(0, deadline - (time.time() - issued_time)))
+            if late or primary['error'] is not None:
+                with self.lock:
+                    self.hedges += 1
+                attempts.append(self.start(storage, bucket_name, key_name, retrier, extra_get_args, any_done))
+
+        while True:
+            any_done.clear()
+            finished = [a for a in attempts if a['done'].is_set()]
+            winners = [a for a in finished if a['error'] is None]
+            if winners:
+                break
+            if len(finished) == len(attempts):
+                raise finished[0]['error']
+            any_done.wait()
+
+        winner = winners[0]
+        with self.lock:
+            for a in attempts:
+                if a is not winner:
+                    a['cancelled'].set()
+                    if a['result'] is not None:
+                        self.wasted_bytes += len(a['result'][0])
+            if winner is not primary:
+                self.hedges_won += 1
+
+        data, first_byte_time, end_time = winner['result']
+        return data, issued_time, first_byte_time, end_time
+
+    def stats(self):
+        return {'hedges': self.hedges, 'hedges_won': self.hedges_won, 'wasted_bytes': self.wasted_bytes}
+
+
+def ranged_read(storage, bucket_name, key_name, range_size, read_threads, consume, blocksize=1024*1024,
+                retrier=None, hedger=None):
+    """
+    Reads an object as disjoint byte ranges fetched in parallel from a
+    thread pool sharing the storage client's connection pool. Ranges are
+    passed to consume() in order, keeping at most 2*read_threads ranges
+    in flight or buffered. Ranges are hedged if a hedger is given.
+    Returns the per-range timings.
+    """
+    retrier = retrier or Retrier()
+    object_size = int(retrier.call(storage.head_object, bucket_name, key_name)['content-length'])
+    range_count = -(-object_size // range_size)
+
+    def read_range(range_id):
+        first_byte = range_id * range_size
+        last_byte = min(first_byte + range_size, object_size) - 1
+        extra_get_args = {'Range': 'bytes={}-{}'.format(first_byte, last_byte)}
+        if hedger is not None:
+            data, start_time, first_byte_time, end_time = hedger.get(storage, bucket_name, key_name, retrier,
+                                                                     extra_get_args)
+        else:
+            start_time = time.time()
+            data, first_byte_time, end_time = get_body(storage, bucket_name, key_name, retrier, blocksize,
+                                                       extra_get_args)
+        return data, {'range_id': range_id, 'bytes': len(data), 'start_time': start_time,
+                      'first_byte_time': first_byte_time, 'end_time': end_time}
+
+    ranges = []
+    pending = deque()
+    next_range = 0
+    with ThreadPoolExecutor(max_workers=read_threads) as pool:
+        while next_range < range_count or pending:
+            while next_range < range_count and len(pending) < 2 * read_threads:
+                pending.append(pool.submit(read_range, next_range))
+                next_range += 1
+            data, range_stats = pending.popleft().result()
+            consume(data)
+            ranges.append(range_stats)
+
+    return ranges
+
+
+def read(bucket_name, number, keylist_raw, read_times, range_size=0, read_threads=1,
+         integrity='md5', hash_thread=False, res_path=None, resume=False, retries=0, key_layout='random',
+         hedge_percentile=0, hedge_ttfb=None, hedge_latency=None, sample_interval=0.1, memory=RUNTIME_MEMORY,
+         exc=None):
 
     blocksize = 1024*1024
 
     def read_object(key_name, storage):
-        m = hashlib.md5()
+        checker = IntegrityChecker(integrity, hash_thread)
+        retrier = Retrier(retries)
+        hedger = Hedger(hedge_percentile, hedge_ttfb, hedge_latency, blocksize) if hedge_percentile else None
         bytes_read = 0
+        ranges = []
+        requests = []
         print(key_name)
 
+        def consume(buf):
+            nonlocal bytes_read
+            bytes_read += len(buf)
+            sampler.add(len(buf))
+            checker.update(buf)
+
         start_time = time.time()
+        sampler = ThroughputSampler(start_time, sample_interval)
         for unused in range(read_times):
-            fileobj = storage.get_object(bucket_name, key_name, stream=True)
             try:
-                buf = fileobj.read(blocksize)
+                if range_size:
+                    new_ranges = ranged_read(storage, bucket_name, key_name,
+                                             range_size, read_threads, consume, blocksize, retrier, hedger)
+                    ranges.extend(new_ranges)
+                    requests.extend((r['start_time'], r['first_byte_time'], r['end_time']) for r in new_ranges)
+                    continue
+                issued_time = time.time()
+                fileobj = retrier.call(storage.get_object, bucket_name, key_name, stream=True)
+            except Exception as e:
+                print(e)
+                continue
+            try:
+                # read the first byte alone, the TTFB must not include a block
+                buf = fileobj.read(1)
+                first_byte_time = time.time()
                 while len(buf) > 0:
-                    bytes_read += len(buf)
-                    #if bytes_read % (blocksize *10) == 0:
-                    #    mb_rate = bytes_read/(time.time()-t1)/1e6
-                    #    print('POS:'+str(bytes_read)+' MB Rate: '+ str(mb_rate))
-                    m.update(buf)
+                    consume(buf)
                     buf = fileobj.read(blocksize)
+                requests.append((issued_time, first_byte_time, time.time()))
             except Exception as e:
+                retrier.record(e)
                 print(e)
-                pass
+        recv_end_time = time.time()
+        digest = checker.hexdigest()
         end_time = time.time()
         mb_rate = bytes_read/(end_time-start_time)/1e6
         print('MB Rate: '+str(mb_rate))
 
-        return {'start_time': start_time, 'end_time': end_time, 'mb_rate': mb_rate, 'bytes_read': bytes_read}
+        # inline hashing runs between reads, so it is not receive time
+        recv_time = recv_end_time - start_time
+        if not checker.threaded:
+            recv_time -= checker.hash_time
+        recv_mb_rate = bytes_read/recv_time/1e6
+
+        res = {'start_time': start_time, 'end_time': end_time, 'mb_rate': mb_rate, 'bytes_read': bytes_read,
+               'recv_time': recv_time, 'recv_mb_rate': recv_mb_rate, 'hash_time': checker.hash_time,
+               'integrity': integrity, 'digest': digest, 'requests': request_times(requests),
+               'sample_interval': sample_interval, 'throughput': sampler.array()}
+        res.update(retrier.stats())
+        if hedger is not None:
+            res.update(hedger.stats())
+        if range_size:
+            res['ranges'] = ranges
+
+        return res
+
+    if hedge_percentile and not range_size:
+        # hedged responses are buffered, ranges bound the memory they take
+        raise ValueError('Hedged reads need ranged reads, use --hedge_percentile with --range_size_mb')
 
-    if number == 0:
+    collector = RunCollector(res_path, resume)
+    # a resumed run keeps the parameters and keys it was started with
+    params = collector.run_params({'bucket_name': bucket_name,
+                                   'number': number,
+                                   'read_times': read_times,
+                                   'memory': memory,
+                                   'range_size': range_size,
+                                   'read_threads': read_threads,
+                                   'integrity': integrity,
+                                   'hash_thread': hash_thread,
+                                   'retries': retries,
+                                   'key_layout': key_layout,
+                                   'hedge_percentile': hedge_percentile,
+                                   'hedge_ttfb': hedge_ttfb,
+                                   'hedge_latency': hedge_latency,
+                                   'sample_interval': sample_interval})
+    bucket_name, number, read_times, memory, range_size, read_threads, integrity, hash_thread, retries, \
+        hedge_percentile, hedge_ttfb, hedge_latency, sample_interval = \
+        [params[k] for k in ('bucket_name', 'number', 'read_times', 'memory', 'range_size', 'read_threads',
+                             'integrity', 'hash_thread', 'retries', 'hedge_percentile', 'hedge_ttfb',
+                             'hedge_latency', 'sample_interval')]
+    if 'keynames' in collector.meta:
+        keynames = collector.meta['keynames']
+    elif number == 0:
         keynames = keylist_raw
     else:
         keynames = [keylist_raw[i % len(keylist_raw)] for i in range(number)]
 
-    exc = FunctionExecutor(runtime_memory=1024)
+    exc = exc or get_executor(runtime_memory=memory)
+    res = collector.map(exc, read_object, keynames,
+                        meta=dict(params, keynames=keynames),
+                        quantity=lambda r: r['bytes_read'] / 1e6)
+    results = res['results']
+    if not results:
+        print('No worker completed the read')
+        return res
+
+    if range_size:
+        range_latencies = [r['end_time']-r['start_time'] for res in results for r in res.get('ranges', ())]
+        print('Range size: {} MB - Read threads: {}'.format(range_size/1024**2, read_threads))
+        if range_latencies:
+            print('Range latency p50/p99 (s):', round(np.percentile(range_latencies, 50), 3),
+                  round(np.percentile(range_latencies, 99), 3))
+    print('Mean worker MB Rate:', round(np.mean([r['mb_rate'] for r in results]), 2))
+    print('Mean worker receive MB Rate:', round(np.mean([r['recv_mb_rate'] for r in results]), 2))
+    if integrity != 'none':
+        print('Mean {} hash time (s): {}'.format(integrity, round(np.mean([r['hash_time'] for r in results]), 3)))
+    print_latency_percentiles('Read', results)
+    print_retry_stats('Read', results)
+    if hedge_percentile:
+        print('Hedged requests: {} ({} won) - wasted {:.2f} MB'.format(
+            sum(r['hedges'] for r in results), sum(r['hedges_won'] for r in results),
+            sum(r['wasted_bytes'] for r in results) / 1e6))
+    print_cost(res)
+
+    return res
+
+
+def ramp_step_stats(res, workers, size_key):
+    """
+    Aggregate throughput and error rate of one ramp step. Throughput is
+    the bytes moved by all workers over the span of the step, the error
+    rate the failed attempts (throttled, errored requests and failed
+    workers) over all attempts.
+    """
+    results = res['results']
+    failed = workers - len(results)
+    if not results:
+        return {'workers': workers, 'mb_rate': 0.0, 'error_rate': 1.0, 'throttled': 0, 'errors': failed}
+    total_bytes = sum(r.get(size_key, 0) for r in results)
+    span = max(corrected(r, 'end_time') for r in results) - min(corrected(r, 'start_time') for r in results)
+    throttled = sum(r.get('throttled', 0) for r in results)
+    errors = sum(r.get('errors', 0) for r in results) + failed
+    requests = sum(len(r.get('requests', ())) for r in results)
+    attempts = requests + throttled + errors
+    return {'workers': workers, 'mb_rate': total_bytes/span/1e6 if span > 0 else 0.0,
+            'error_rate': (throttled + errors) / attempts if attempts else 0.0,
+            'throttled': throttled, 'errors': errors}
+
+
+def ramp(bucket_name, mb_per_file, key_prefix, start, factor, max_workers, min_gain, error_threshold,
+         retries, outdir, name):
+    """
+    Steps the number of concurrent workers geometrically, running a write
+    and a read test at each step, until the aggregate throughput stops
+    growing by min_gain or the error rate goes over error_threshold. The
+    knee is the last step that still improved the throughput by min_gain.
+    """
+    steps = []
+    workers = start
+    knee = None
+    while workers <= max_workers:
+        print('Ramp step: {} workers'.format(workers))
+        prefix = '{}/{}_ramp_{}'.format(outdir, name, workers)
+        res_write = write(bucket_name, mb_per_file, workers, key_prefix, retries=retries,
+                          res_path=prefix + '_write')
+        res_read = read(bucket_name, 0, res_write['keynames'], 1, integrity='none', retries=retries,
+                        res_path=prefix + '_read')
+        delete_temp_data(bucket_name, res_write['keynames'])
+
+        step = {'workers': workers,
+                'write': ramp_step_stats(res_write, workers, 'bytes_written'),
+                'read': ramp_step_stats(res_read, workers, 'bytes_read')}
+        steps.append(step)
+        print('{} workers - write: {:.2f} MB/s ({:.1%} errors) - read: {:.2f} MB/s ({:.1%} errors)'.format(
+              workers, step['write']['mb_rate'], step['write']['error_rate'],
+              step['read']['mb_rate'], step['read']['error_rate']))
+
+        if max(step['write']['error_rate'], step['read']['error_rate']) > error_threshold:
+            print('Error rate over {:.1%}, stopping'.format(error_threshold))
+            break
+        if len(steps) > 1:
+            prev = steps[-2]
+            gains = [step[op]['mb_rate'] / prev[op]['mb_rate'] - 1 if prev[op]['mb_rate'] else 0
+                     for op in ('write', 'read')]
+            if max(gains) < min_gain:
+                knee = prev['workers']
+                print('Throughput gain under {:.0%}, stopping'.format(min_gain))
+                break
+        knee = workers
+        workers = max(workers + 1, int(round(workers * factor)))
+
+    print('Saturation knee: {} workers'.format(knee))
+    res = {'bucket_name': bucket_name, 'mb_per_file': mb_per_file, 'start': start, 'factor': factor,
+           'min_gain': min_gain, 'error_threshold': error_threshold, 'retries': retries,
+           'knee': knee, 'steps': steps}
+    save_results(res, '{}/{}_ramp'.format(outdir, name))
+    return res
+
+
+OP_TYPES = ['put', 'get', 'head', 'list', 'delete']
+
+
+def ops(bucket_name, number, object_size, objects, concurrency, key_prefix, op_types, res_path=None):
+    """
+    Small-object request rate benchmark. Every worker runs a PUT, GET,
+    HEAD, LIST and DELETE phase over its own set of objects, issuing
+    the requests of each phase from concurrency threads. Objects are
+    always written first and removed last, even if those phases are
+    not measured.
+    """
+
+    def ops_worker(worker_prefix, storage):
+        payload = RandomDataGenerator(object_size).read()
+        keys = ['{}{:06d}'.format(worker_prefix, i) for i in range(objects)]
+        calls = {'put': lambda key: storage.put_object(bucket_name, key, payload),
+                 'get': lambda key: storage.get_object(bucket_name, key),
+                 'head': lambda key: storage.head_object(bucket_name, key),
+                 'list': lambda key: storage.list_keys(bucket_name, prefix=worker_prefix),
+                 'delete': lambda key: storage.delete_object(bucket_name, key)}
+
+        def timed_call(call, key):
+            issued_time = time.time()
+            try:
+                call(key)
+                ok = True
+            except Exception as e:
+                print(e)
+                ok = False
+            return issued_time, time.time(), ok
+
+        res = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for op in OP_TYPES:
+                if op not in op_types and op not in ('put', 'delete'):
+                    continue
+                start_time = time.time()
+                times = np.array(list(pool.map(lambda key: timed_call(calls[op], key), keys)))
+                end_time = time.time()
+                if op not in op_types:
+                    continue
+                ok = times[:, 2] > 0
+                res[op] = {'start_time': start_time, 'end_time': end_time,
+                           'ops': int(ok.sum()), 'errors': int((~ok).sum()),
+                           'ops_rate': ok.sum()/(end_time-start_time),
+                           'latencies': times[ok, 1] - times[ok, 0]}
+                print('{}: {} ops/sec'.format(op.upper(), res[op]['ops_rate']))
+
+        return res
+
+    run_id = uuid.uuid4().hex[:8].upper()
+    worker_prefixes = ['{}ops-{}/{:05d}/'.format(key_prefix, run_id, i) for i in range(number)]
+
+    exc = get_executor(runtime_memory=RUNTIME_MEMORY)
+    collector = RunCollector(res_path)
+    res = collector.map(exc, ops_worker, worker_prefixes,
+                        meta={'bucket_name': bucket_name,
+                              'object_size': object_size,
+                              'objects': objects,
+                              'concurrency': concurrency,
+                              'op_types': list(op_types)},
+                        quantity=lambda r: sum(r[op]['ops'] for op in OP_TYPES if op in r), unit='ops/sec')
+    results = res['results']
+
+    for op in OP_TYPES:
+        if op not in op_types:
+            continue
+        latencies = [r[op]['latencies'] for r in results if len(r[op]['latencies'])]
+        ops_n = sum(r[op]['ops'] for r in results)
+        errors = sum(r[op]['errors'] for r in results)
+        if not latencies:
+            print('{:>6}: {} ops, {} errors'.format(op.upper(), ops_n, errors))
+            continue
+        latencies = np.concatenate(latencies) * 1000
+        print('{:>6}: {} ops, {} errors, {:.1f} ops/sec - latency p50/p90/p99: {:.1f}/{:.1f}/{:.1f} ms'.format(
+            op.upper(), ops_n, errors, sum(r[op]['ops_rate'] for r in results),
+            *np.percentile(latencies, [50, 90, 99])))
+
+    return res
+
+
+INFLIGHT_OPS = ['put', 'get']
+
+
+async def run_inflight(call, keys, depth):
+    """
+    Runs call(key) for every key from an asyncio loop on a pool of depth
+    threads, which keeps up to depth calls in flight. The threads share
+    the storage client and its connection pool. Returns the issue time,
+    completion time and success of every call.
+    """
+    loop = asyncio.get_running_loop()
+
+    def timed_call(key):
+        # timed in the thread, calls waiting for a free thread are not issued yet
+        issued_time = time.time()
+        try:
+            call(key)
+            ok = True
+        except Exception as e:
+            print(e)
+            ok = False
+        return issued_time, time.time(), ok
+
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        return await asyncio.gather(*[loop.run_in_executor(pool, timed_call, key) for key in keys])
+
+
+def inflight(bucket_name, number, object_size, objects, depths, op_types, key_prefix):
+    """
+    Small-object requests at growing in-flight depths within each worker.
+    Every worker writes objects small objects and then, for every depth,
+    PUTs and GETs all of them again keeping depth requests in flight, to
+    find the depth at which a single function saturates. Depths over the
+    connection pool size of the storage client queue on the pool, so the
+    levels record the depth actually reaching the storage.
+    """
+
+    def inflight_worker(worker_prefix, storage):
+        payload = RandomDataGenerator(object_size).read()
+        keys = ['{}{:06d}'.format(worker_prefix, i) for i in range(objects)]
+        calls = {'put': lambda key: storage.put_object(bucket_name, key, payload),
+                 'get': lambda key: storage.get_object(bucket_name, key)}
+        client = storage.get_client()
+        config = getattr(getattr(client, 'meta', None), 'config', None)
+        pool_size = getattr(config, 'max_pool_connections', None) or 0
+
+        asyncio.run(run_inflight(calls['put'], keys, max(depths)))
+        levels = []
+        for depth in depths:
+            for op in INFLIGHT_OPS:
+                if op not in op_types:
+                    continue
+                start_time = time.time()
+                times = np.array(asyncio.run(run_inflight(calls[op], keys, depth)))
+                end_time = time.time()
+                ok = times[:, 2] > 0
+                latencies = times[ok, 1] - times[ok, 0] if ok.any() else np.zeros(1)
+                levels.append({'depth': depth, 'op': op, 'start_time': start_time, 'end_time': end_time,
+                               'pool_depth': min(depth, pool_size) if pool_size else depth,
+                               'ops': int(ok.sum()), 'errors': int((~ok).sum()),
+                               'ops_rate': ok.sum()/(end_time-start_time),
+                               'mb_rate': ok.sum()*object_size/(end_time-start_time)/1e6,
+                               'latency_p50': np.percentile(latencies, 50),
+                               'latency_p99': np.percentile(latencies, 99)})
+                print('{} depth {}: {:.1f} ops/sec'.format(op.upper(), depth, levels[-1]['ops_rate']))
+        storage.delete_objects(bucket_name, keys)
+
+        return {'levels': levels, 'max_pool_connections': pool_size}
+
+    run_id = uuid.uuid4().hex[:8].upper()
+    worker_prefixes = ['{}inflight-{}/{:05d}/'.format(key_prefix, run_id, i) for i in range(number)]
+
+    exc = get_executor(runtime_memory=RUNTIME_MEMORY)
     start_time = time.time()
-    worker_futures = exc.map(read_object, keynames)
+    worker_futures = exc.map(inflight_worker, worker_prefixes)
     results = exc.get_result()
     end_time = time.time()
 
-    total_time = end_time-start_time
     worker_stats = [f.stats for f in worker_futures]
+    total_time = end_time-start_time
+
+    pool_size = max([r['max_pool_connections'] for r in results], default=0)
+    print('Connection pool size: {}'.format(pool_size or 'unknown'))
+    for op in INFLIGHT_OPS:
+        if op not in op_types or not results:
+            continue
+        for depth in depths:
+            levels = [l for r in results for l in r['levels'] if l['op'] == op and l['depth'] == depth]
+            print('{:>4} depth {:>4}: {:.1f} ops/sec - {:.2f} MB/s per worker - latency p50/p99: {:.1f}/{:.1f} ms{}'.format(
+                op.upper(), depth, np.mean([l['ops_rate'] for l in levels]), np.mean([l['mb_rate'] for l in levels]),
+                np.mean([l['latency_p50'] for l in levels]) * 1000, np.mean([l['latency_p99'] for l in levels]) * 1000,
+                ' - capped at {} by the connection pool'.format(pool_size) if pool_size and depth > pool_size else ''))
 
     res = {'start_time': start_time,
            'total_time': total_time,
            'worker_stats': worker_stats,
+           'bucket_name': bucket_name,
+           'object_size': object_size,
+           'objects': objects,
+           'depths': list(depths),
+           'op_types': list(op_types),
            'results': results}
 
     return res
 
 
-def delete_temp_data(bucket_name, keynames):
-    exc = FunctionExecutor(runtime_memory=1024)
+SIZE_DISTRIBUTIONS = ['fixed', 'uniform', 'lognormal']
+ACCESS_PATTERNS = ['uniform', 'zipfian', 'hotkey']
+
+
+def object_sizes(size_dist, n, size, rng):
+    """
+    Draws n object sizes in bytes averaging size: all equal (fixed),
+    uniform in [1, 2*size] or lognormal with sigma 1
+    """
+    if size_dist == 'fixed':
+        return np.full(n, size, dtype=np.int64)
+    if size_dist == 'uniform':
+        return rng.integers(1, 2*size + 1, n)
+    sigma = 1.0
+    return np.maximum(1, rng.lognormal(np.log(size) - sigma**2/2, sigma, n)).astype(np.int64)
+
+
+def key_popularity(access, keys, zipf_s=1.1, hot_fraction=0.01, hot_prob=0.9):
+    """
+    Probability of accessing each of the keys: uniform, zipfian with
+    exponent zipf_s, or hotkey, where the first hot_fraction of the keys
+    receive hot_prob of the accesses. Key 0 is always the most popular.
+    """
+    if access == 'uniform':
+        return np.full(keys, 1/keys)
+    if access == 'zipfian':
+        p = 1 / np.arange(1, keys + 1) ** zipf_s
+        return p / p.sum()
+    hot_keys = max(1, int(round(keys * hot_fraction)))
+    if hot_keys == keys:
+        return np.full(keys, 1/keys)
+    p = np.full(keys, (1 - hot_prob) / (keys - hot_keys))
+    p[:hot_keys] = hot_prob / hot_keys
+    return p
+
+
+def print_mixed(results, keys, hot_fraction):
+    """
+    Prints the GET and PUT rates and latencies of a mixed run, and the
+    GET latency on the most popular keys compared to the rest
+    """
+    if not results:
+        print('No worker completed the mixed workload')
+        return
+    span = max(corrected(r, 'end_time') for r in results) - min(corrected(r, 'start_time') for r in results)
+    for op in ('get', 'put'):
+        ops_n = sum(r[op]['ops'] for r in results)
+        print('{:>4}: {} ops, {} errors, {:.1f} ops/sec, {:.2f} MB/s'.format(
+            op.upper(), ops_n, sum(r[op]['errors'] for r in results), ops_n / span,
+            sum(r[op]['bytes'] for r in results) / span / 1e6))
+        print_latency_percentiles('  ' + op.upper(), [r[op] for r in results])
+
+    get_keys = [r['get']['keys'] for r in results if len(r['get'].get('keys', ()))]
+    if not get_keys:
+        return
+    get_keys = np.concatenate(get_keys)
+    get_requests = np.concatenate([r['get']['requests'] for r in results if len(r['get'].get('keys', ()))])
+    hot = get_keys < max(1, int(round(keys * hot_fraction)))
+    latency = get_requests[:, 2] - get_requests[:, 0]
+    for label, mask in (('hot keys', hot), ('other keys', ~hot)):
+        if mask.any():
+            print('GET {}: {} requests - latency p50/p99: {:.3f}/{:.3f} s'.format(
+                label, int(mask.sum()), *np.percentile(latency[mask], [50, 99])))
+
+
+def mixed(bucket_name, number, keys, ops_per_worker, read_ratio, object_size, size_dist, access,
+          zipf_s, hot_fraction, hot_prob, concurrency, key_prefix, seed=0, res_path=None):
+    """
+    Mixed workload benchmark. A set of keys objects is written first, then
+    every worker issues ops_per_worker requests from concurrency threads,
+    each a GET of a key picked with the access distribution (read_ratio of
+    them) or a PUT of a new output object. Object sizes follow size_dist.
+    """
+    run_id = uuid.uuid4().hex[:8].upper()
+    run_prefix = '{}mixed-{}/'.format(key_prefix, run_id)
+    keynames = ['{}in/{:07d}'.format(run_prefix, i) for i in range(keys)]
+    popularity = key_popularity(access, keys, zipf_s, hot_fraction, hot_prob)
+    blocksize = 1024*1024
+
+    def populate_worker(worker_id, storage):
+        rng = np.random.default_rng([seed, worker_id, 0])
+        worker_keys = keynames[worker_id::number]
+        sizes = object_sizes(size_dist, len(worker_keys), object_size, rng)
+        payload = RandomDataGenerator(int(sizes.max()))
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda i: storage.put_object(bucket_name, worker_keys[i], payload.part(0, int(sizes[i]))),
+                          range(len(worker_keys))))
+        return len(worker_keys)
+
+    def mixed_worker(worker_id, storage):
+        rng = np.random.default_rng([seed, worker_id, 1])
+        is_read = rng.random(ops_per_worker) < read_ratio
+        key_ids = rng.choice(keys, size=ops_per_worker, p=popularity)
+        sizes = object_sizes(size_dist, ops_per_worker, object_size, rng)
+        payload = RandomDataGenerator(int(sizes.max()))
+
+        def run_op(i):
+            issued_time = time.time()
+            try:
+                if is_read[i]:
+                    fileobj = storage.get_object(bucket_name, keynames[key_ids[i]], stream=True)
+                    buf = fileobj.read(1)
+                    first_byte_time = time.time()
+                    bytes_n = 0
+                    while len(buf) > 0:
+                        bytes_n += len(buf)
+                        buf = fileobj.read(blocksize)
+                else:
+                    body = payload.part(0, int(sizes[i]))
+                    storage.put_object(bucket_name, '{}out/{:05d}/{:07d}'.format(run_prefix, worker_id, i), body)
+                    first_byte_time = body.first_read_time or time.time()
+                    bytes_n = int(sizes[i])
+                return issued_time, first_byte_time, time.time(), bytes_n, True
+            except Exception as e:
+                print(e)
+                return issued_time, issued_time, time.time(), 0, False
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            times = np.array(list(pool.map(run_op, range(ops_per_worker))), dtype=np.float64).reshape(-1, 5)
+        end_time = time.time()
+
+        res = {'start_time': start_time, 'end_time': end_time}
+        ok = times[:, 4] > 0
+        for op, mask in (('get', is_read), ('put', ~is_read)):
+            done = mask & ok
+            res[op] = {'ops': int(done.sum()), 'errors': int((mask & ~ok).sum()),
+                       'bytes': int(times[done, 3].sum()),
+                       'ops_rate': done.sum()/(end_time-start_time),
+                       'mb_rate': times[done, 3].sum()/(end_time-start_time)/1e6,
+                       'requests': times[done, :3]}
+        res['get']['keys'] = key_ids[is_read & ok]
+        print('GET: {:.1f} ops/sec - PUT: {:.1f} ops/sec'.format(res['get']['ops_rate'], res['put']['ops_rate']))
+        return res
+
+    exc = get_executor(runtime_memory=RUNTIME_MEMORY)
+    try:
+        print('Writing {} objects...'.format(keys))
+        exc.map(populate_worker, range(min(number, keys)))
+        exc.get_result()
+
+        collector = RunCollector(res_path)
+        res = collector.map(exc, mixed_worker, list(range(number)),
+                            meta={'bucket_name': bucket_name,
+                                  'keynames': keynames,
+                                  'run_prefix': run_prefix,
+                                  'ops_per_worker': ops_per_worker,
+                                  'read_ratio': read_ratio,
+                                  'object_size': object_size,
+                                  'size_dist': size_dist,
+                                  'access': access,
+                                  'zipf_s': zipf_s,
+                                  'hot_fraction': hot_fraction,
+                                  'hot_prob': hot_prob,
+                                  'concurrency': concurrency,
+                                  'seed': seed},
+                            quantity=lambda r: (r['get']['bytes'] + r['put']['bytes']) / 1e6)
+        print_mixed(res['results'], keys, hot_fraction)
+    finally:
+        print('Deleting temp files...')
+        out_keys = exc.storage.list_keys(bucket_name, prefix=run_prefix + 'out/')
+        exc.storage.delete_objects(bucket_name, keynames + out_keys)
+
+    return res
+
+
+def delete_temp_data(bucket_name, keynames, exc=None):
+    exc = exc or get_executor(runtime_memory=RUNTIME_MEMORY)
     print('Deleting temp files...')
     exc.storage.delete_objects(bucket_name, keynames)
     print('Done!')
 
 
+def generator_benchmark(mb_total, chunk_sizes_kb):
+    """
+    Measures locally how fast RandomDataGenerator can source payload
+    through read() and readinto(), to check that uploads are never
+    bound by the generator.
+    """
+    bytes_n = mb_total * 1024**2
+    d = RandomDataGenerator(bytes_n)
+    results = []
+
+    for chunk_kb in chunk_sizes_kb:
+        chunk_size = chunk_kb * 1024
+        buf = bytearray(chunk_size)
+        for method in ['read', 'readinto']:
+            d.seek(0)
+            start_time = time.time()
+            if method == 'read':
+                while len(d.read(chunk_size)) > 0:
+                    pass
+            else:
+                while d.readinto(buf) > 0:
+                    pass
+            end_time = time.time()
+
+            gb_rate = bytes_n/(end_time-start_time)/1e9
+            print('{:>8} {:>8} KB: {:8.2f} GB/s ({:.1f} Gbps)'.format(method, chunk_kb, gb_rate, gb_rate*8))
+            results.append({'method': method, 'chunk_kb': chunk_kb, 'gb_rate': gb_rate})
+
+    return results
+
+
 def create_plots(res_write, res_read, outdir, name):
+    # plots pulls in matplotlib, pandas and seaborn: only the client imports it
+    from plots import create_execution_histogram, create_rates_histogram, create_agg_bdwth_plot, \
+        create_latency_plot
     create_execution_histogram(res_write, res_read, "{}/{}_execution.png".format(outdir, name))
     create_rates_histogram(res_write, res_read, "{}/{}_rates.png".format(outdir, name))
     create_agg_bdwth_plot(res_write, res_read, "{}/{}_agg_bdwth.png".format(outdir, name))
+    create_latency_plot(res_write, res_read, "{}/{}_latency.png".format(outdir, name))
 
 
 @click.group()
+@local_options
 def cli():
     pass
 
@@ -223,44 +1259,168 @@ def cli():
 @click.option('--key_prefix', default='', help='Object key prefix')
 @click.option('--outdir', default='.', help='dir to save results in')
 @click.option('--name', default='flops_benchmark', help='filename to save results in')
-def write_command(bucket_name, mb_per_file, number, key_prefix, outdir, name):
+@click.option('--parts', default=0, help='upload each object as a multipart upload of this many parts', type=int)
+@click.option('--part_size_mb', default=0, help='upload each object as a multipart upload of parts of this size in MB', type=int)
+@click.option('--upload_threads', default=8, help='number of parts uploaded concurrently by each worker', type=int)
+@click.option('--key_layout', default='random', type=click.Choice(KEY_LAYOUTS), help='how the object keys are named')
+@click.option('--key_prefixes', default=16, help='number of hashed prefixes of the hashed key layout', type=int)
+@click.option('--retries', default=0, help='times a failed or throttled request is retried with backoff', type=int)
+@click.option('--resume', is_flag=True, help='only run the workers missing from a previous, interrupted run')
+def write_command(bucket_name, mb_per_file, number, key_prefix, outdir, name, parts, part_size_mb, upload_threads,
+                  key_layout, key_prefixes, retries, resume):
     if bucket_name is None:
         raise ValueError('You must provide a bucket name within --bucket_name parameter')
-    res_write = write(bucket_name, mb_per_file, number, key_prefix)
-    pickle.dump(res_write, open('{}/{}_write.pickle'.format(outdir, name), 'wb'), -1)
+    part_size = get_part_size(mb_per_file, parts, part_size_mb)
+    write(bucket_name, mb_per_file, number, key_prefix, part_size, upload_threads,
+          '{}/{}_write'.format(outdir, name), resume, retries, key_layout, key_prefixes)
 
 
 @cli.command('read')
-@click.option('--key_file', default=None, help="filename generated by write command, which contains the keys to read")
+@click.option('--key_file', default=None, help="run saved by the write command (directory or legacy .pickle), which contains the keys to read")
 @click.option('--number', help='number of objects to read, 0 for all', type=int, default=0)
 @click.option('--outdir', default='.', help='dir to save results in')
 @click.option('--name', default='storage_benchmark', help='filename to save results in')
 @click.option('--read_times', default=1, help="number of times to read each COS key")
-def read_command(key_file, number, outdir, name, read_times):
+@click.option('--range_size_mb', default=0, help='read each object as parallel byte ranges of this size in MB', type=int)
+@click.option('--read_threads', default=8, help='number of ranges each worker reads concurrently', type=int)
+@click.option('--integrity', default='md5', type=click.Choice(INTEGRITY_CHECKS), help='integrity check computed over the data read')
+@click.option('--hash_thread', is_flag=True, help='hash on a background thread overlapping the network reads')
+@click.option('--retries', default=0, help='times a failed or throttled request is retried with backoff', type=int)
+@click.option('--hedge_percentile', default=0.0, help='hedge requests slower than this percentile of the latencies, 0 to disable', type=float)
+@click.option('--hedge_from', default=None, help='previous read run whose latencies give the initial hedging deadlines')
+@click.option('--resume', is_flag=True, help='only run the workers missing from a previous, interrupted run')
+def read_command(key_file, number, outdir, name, read_times, range_size_mb, read_threads, integrity, hash_thread,
+                 retries, hedge_percentile, hedge_from, resume):
     if key_file:
-        res_write = pickle.load(open(key_file, 'rb'))
+        res_write = load_results(key_file, meta_only=True)
     else:
-        res_write = pickle.load(open('{}/{}_write.pickle'.format(outdir, name), 'rb'))
+        res_write = load_results('{}/{}_write'.format(outdir, name), meta_only=True)
     bucket_name = res_write['bucket_name']
     keynames = res_write['keynames']
-    res_read = read(bucket_name, number, keynames, read_times)
-    pickle.dump(res_read, open('{}/{}_read.pickle'.format(outdir, name), 'wb'), -1)
+    hedge_ttfb, hedge_latency = None, None
+    if hedge_percentile and hedge_from:
+        ttfb, latency = request_latencies(load_results(hedge_from)['results'])
+        hedge_ttfb, hedge_latency = np.percentile(ttfb, hedge_percentile), np.percentile(latency, hedge_percentile)
+        print('Initial hedging deadlines - TTFB: {:.3f} s - Request: {:.3f} s'.format(hedge_ttfb, hedge_latency))
+    read(bucket_name, number, keynames, read_times, range_size_mb * 1024**2, read_threads,
+         integrity, hash_thread, '{}/{}_read'.format(outdir, name), resume, retries,
+         res_write.get('key_layout', 'random'), hedge_percentile, hedge_ttfb, hedge_latency)
 
 
 @cli.command('delete')
-@click.option('--key_file', default=None, help="filename generated by write command, which contains the keys to read")
+@click.option('--key_file', default=None, help="run saved by the write command (directory or legacy .pickle), which contains the keys to read")
 @click.option('--outdir', default='.', help='dir to save results in')
 @click.option('--name', default='storage_benchmark', help='filename to save results in')
 def delete_command(key_file, outdir, name):
     if key_file:
-        res_write = pickle.load(open(key_file, 'rb'))
+        res_write = load_results(key_file, meta_only=True)
     else:
-        res_write = pickle.load(open('{}/{}_write.pickle'.format(outdir, name), 'rb'))
+        res_write = load_results('{}/{}_write'.format(outdir, name), meta_only=True)
     bucket_name = res_write['bucket_name']
     keynames = res_write['keynames']
     delete_temp_data(bucket_name, keynames)
 
 
+@cli.command('ops')
+@click.option('--bucket_name', help='bucket to save files in')
+@click.option('--number', help='number of workers', type=int)
+@click.option('--object_size_kb', default=4, help='KB of each object', type=int)
+@click.option('--objects', default=100, help='number of objects handled by each worker', type=int)
+@click.option('--concurrency', default=8, help='number of concurrent requests within each worker', type=int)
+@click.option('--op', 'op_types', default=OP_TYPES, multiple=True, type=click.Choice(OP_TYPES),
+              help='operation to measure, can be repeated')
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='storage_benchmark', help='filename to save results in')
+def ops_command(bucket_name, number, object_size_kb, objects, concurrency, op_types, key_prefix, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    res_ops = ops(bucket_name, number, object_size_kb * 1024, objects, concurrency, key_prefix, op_types,
+                  '{}/{}_ops'.format(outdir, name))
+    from plots import create_ops_histogram
+    create_ops_histogram(res_ops, "{}/{}_ops.png".format(outdir, name))
+
+
+@cli.command('ramp')
+@click.option('--bucket_name', help='bucket to save files in')
+@click.option('--mb_per_file', default=64, help='MB of each object', type=int)
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--start', default=1, help='number of workers of the first step', type=int)
+@click.option('--factor', default=2.0, help='growth factor of the number of workers between steps', type=float)
+@click.option('--max_workers', default=1024, help='largest number of workers tried', type=int)
+@click.option('--min_gain', default=0.1, help='stop when a step improves the aggregate throughput by less than this fraction', type=float)
+@click.option('--error_threshold', default=0.05, help='stop when the fraction of failed or throttled requests goes over this', type=float)
+@click.option('--retries', default=3, help='times a failed or throttled request is retried with backoff', type=int)
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='storage_benchmark', help='filename to save results in')
+def ramp_command(bucket_name, mb_per_file, key_prefix, start, factor, max_workers, min_gain, error_threshold,
+                 retries, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    res_ramp = ramp(bucket_name, mb_per_file, key_prefix, start, factor, max_workers, min_gain, error_threshold,
+                    retries, outdir, name)
+    from plots import create_ramp_plot
+    create_ramp_plot(res_ramp, '{}/{}_ramp.png'.format(outdir, name))
+
+
+@cli.command('inflight')
+@click.option('--bucket_name', help='bucket to save files in')
+@click.option('--number', default=1, help='number of workers', type=int)
+@click.option('--object_size_kb', default=4, help='KB of each object', type=int)
+@click.option('--objects', default=1000, help='number of objects handled by each worker', type=int)
+@click.option('--depth', 'depths', default=[1, 4, 16, 64, 128], multiple=True, type=int,
+              help='number of requests kept in flight by each worker, can be repeated')
+@click.option('--op', 'op_types', default=INFLIGHT_OPS, multiple=True, type=click.Choice(INFLIGHT_OPS),
+              help='operation to measure, can be repeated')
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='storage_benchmark', help='filename to save results in')
+def inflight_command(bucket_name, number, object_size_kb, objects, depths, op_types, key_prefix, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    res_inflight = inflight(bucket_name, number, object_size_kb * 1024, objects, sorted(depths), op_types, key_prefix)
+    save_results(res_inflight, '{}/{}_inflight'.format(outdir, name))
+    from plots import create_inflight_plot
+    create_inflight_plot(res_inflight, '{}/{}_inflight.png'.format(outdir, name))
+
+
+@cli.command('mixed')
+@click.option('--bucket_name', help='bucket to save files in')
+@click.option('--number', help='number of workers', type=int)
+@click.option('--keys', default=1000, help='number of objects reads are spread over', type=int)
+@click.option('--ops', 'ops_per_worker', default=200, help='number of requests issued by each worker', type=int)
+@click.option('--read_ratio', default=0.8, help='fraction of the requests that are reads, the rest are writes', type=float)
+@click.option('--object_size_kb', default=1024, help='mean KB of each object', type=int)
+@click.option('--size_dist', default='fixed', type=click.Choice(SIZE_DISTRIBUTIONS), help='distribution of the object sizes')
+@click.option('--access', default='uniform', type=click.Choice(ACCESS_PATTERNS), help='distribution of the keys read')
+@click.option('--zipf_s', default=1.1, help='exponent of the zipfian access distribution', type=float)
+@click.option('--hot_fraction', default=0.01, help='fraction of the keys that are hot', type=float)
+@click.option('--hot_prob', default=0.9, help='fraction of the reads that go to the hot keys (hotkey access)', type=float)
+@click.option('--concurrency', default=8, help='number of concurrent requests within each worker', type=int)
+@click.option('--seed', default=0, help='seed of the random workload', type=int)
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='storage_benchmark', help='filename to save results in')
+def mixed_command(bucket_name, number, keys, ops_per_worker, read_ratio, object_size_kb, size_dist, access, zipf_s,
+                  hot_fraction, hot_prob, concurrency, seed, key_prefix, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    res_mixed = mixed(bucket_name, number, keys, ops_per_worker, read_ratio, object_size_kb * 1024, size_dist, access,
+                      zipf_s, hot_fraction, hot_prob, concurrency, key_prefix, seed,
+                      '{}/{}_mixed'.format(outdir, name))
+    from plots import create_latency_plot
+    create_latency_plot({'results': [r['put'] for r in res_mixed['results']]},
+                        {'results': [r['get'] for r in res_mixed['results']]},
+                        '{}/{}_mixed_latency.png'.format(outdir, name))
+
+
+@cli.command('generator')
+@click.option('--mb_total', default=1024, help='MB to generate per measurement', type=int)
+@click.option('--chunk_kb', default=[8, 64, 1024, 8192], multiple=True, help='read size in KB, can be repeated', type=int)
+def generator_command(mb_total, chunk_kb):
+    generator_benchmark(mb_total, chunk_kb)
+
+
 @cli.command('run')
 @click.option('--bucket_name', help='bucket to save files in')
 @click.option('--mb_per_file', help='MB of each object', type=int)
@@ -269,25 +1429,39 @@ def delete_command(key_file, outdir, name):
 @click.option('--outdir', default='.', help='dir to save results in')
 @click.option('--name', default='flops_benchmark', help='filename to save results in')
 @click.option('--read_times', default=1, help="number of times to read each COS key")
-def run(bucket_name, mb_per_file, number, key_prefix, outdir, name, read_times):
+@click.option('--parts', default=0, help='upload each object as a multipart upload of this many parts', type=int)
+@click.option('--part_size_mb', default=0, help='upload each object as a multipart upload of parts of this size in MB', type=int)
+@click.option('--upload_threads', default=8, help='number of parts uploaded concurrently by each worker', type=int)
+@click.option('--range_size_mb', default=0, help='read each object as parallel byte ranges of this size in MB', type=int)
+@click.option('--read_threads', default=8, help='number of ranges each worker reads concurrently', type=int)
+@click.option('--integrity', default='md5', type=click.Choice(INTEGRITY_CHECKS), help='integrity check computed over the data read')
+@click.option('--hash_thread', is_flag=True, help='hash on a background thread overlapping the network reads')
+@click.option('--key_layout', default='random', type=click.Choice(KEY_LAYOUTS), help='how the object keys are named')
+@click.option('--key_prefixes', default=16, help='number of hashed prefixes of the hashed key layout', type=int)
+@click.option('--retries', default=0, help='times a failed or throttled request is retried with backoff', type=int)
+@click.option('--resume', is_flag=True, help='only run the workers missing from a previous, interrupted run')
+def run(bucket_name, mb_per_file, number, key_prefix, outdir, name, read_times, parts, part_size_mb, upload_threads,
+        range_size_mb, read_threads, integrity, hash_thread, key_layout, key_prefixes, retries, resume):
     if True:
         print('Executing Write Test:')
         if bucket_name is None:
             raise ValueError('You must provide a bucket name within --bucket_name parameter')
-        res_write = write(bucket_name, mb_per_file, number, key_prefix)
-        pickle.dump(res_write, open('{}/{}_write.pickle'.format(outdir, name), 'wb'), -1)
+        part_size = get_part_size(mb_per_file, parts, part_size_mb)
+        res_write = write(bucket_name, mb_per_file, number, key_prefix, part_size, upload_threads,
+                          '{}/{}_write'.format(outdir, name), resume, retries, key_layout, key_prefixes)
         print('Sleeping 20 seconds...')
         time.sleep(20)
         print('Executing Read Test:')
         bucket_name = res_write['bucket_name']
         keynames = res_write['keynames']
-        res_read = read(bucket_name, number, keynames, read_times)
-        pickle.dump(res_read, open('{}/{}_read.pickle'.format(outdir, name), 'wb'), -1)
+        res_read = read(bucket_name, number, keynames, read_times, range_size_mb * 1024**2, read_threads,
+                        integrity, hash_thread, '{}/{}_read'.format(outdir, name), resume, retries,
+                        res_write['key_layout'])
 
         delete_temp_data(bucket_name, keynames)
     else:
-        res_write = pickle.load(open('{}/{}_write.pickle'.format(outdir, name), 'rb'))
-        res_read = pickle.load(open('{}/{}_read.pickle'.format(outdir, name), 'rb'))
+        res_write = load_results('{}/{}_write'.format(outdir, name))
+        res_read = load_results('{}/{}_read'.format(outdir, name))
     create_plots(res_write, res_read, outdir, name)
 
 
@@ -15,6 +15,7 @@
 #
 
 import os
+import sys
 import pylab
 import logging
 import numpy as np
@@ -22,6 +23,10 @@ import pandas as pd
 import seaborn as sns
 from matplotlib.collections import LineCollection
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.timeline import time_bins, in_flight, sweep, segments
+from common.clock import corrected
+
 pylab.switch_backend("Agg")
 logger = logging.getLogger(__name__)
 
@@ -29,7 +34,7 @@ READ_COLOR = (0.12156862745098039, 0.4666666666666667, 0.7058823529411765)
 WRITE_COLOR = (1.0, 0.4980392156862745, 0.054901960784313725)
 
 
-def create_execution_histogram(res_write, res_read, dst):
+def create_execution_histogram(res_write, res_read, dst, bin_size=1.0):
 
     def compute_times_rates(time_rates):
         x = np.array(time_rates)
@@ -37,46 +42,34 @@ def create_execution_histogram(res_write, res_read, dst):
         tr_start_time = x[:, 0] - tzero
         tr_end_time = x[:, 1] - tzero
 
-        N = len(tr_start_time)
-
-        runtime_calls_hist = np.zeros((N, len(runtime_bins)))
-
-        for i in range(N):
-            s = tr_start_time[i]
-            e = tr_end_time[i]
-            a, b = np.searchsorted(runtime_bins, [s, e])
-            if b-a > 0:
-                runtime_calls_hist[i, a:b] = 1
-
         return {'start_time': tr_start_time,
                 'end_time': tr_end_time,
-                'runtime_calls_hist': runtime_calls_hist}
+                'runtime_calls': in_flight(runtime_bins, tr_start_time, tr_end_time)}
 
     fig, axes2d = pylab.subplots(nrows=1, ncols=2, sharex=True, sharey=True, figsize=(5, 5))
 
     for plot_i, (datum, l, c) in enumerate([(res_write, 'Write', WRITE_COLOR), (res_read, 'Read', READ_COLOR)]):
 
         start_time = datum['start_time']
-        time_rates = [(f['worker_start_tstamp'], f['worker_end_tstamp']) for f in datum['worker_stats']]
+        time_rates = [(corrected(f, 'worker_start_tstamp'), corrected(f, 'worker_end_tstamp'))
+                      for f in datum['worker_stats']]
         total_calls = len(time_rates)
 
         if plot_i == 0:
             max_seconds = int(max([tr[1]-start_time for tr in time_rates])*1.2)
             max_seconds = 8 * round(max_seconds/8)
-            runtime_bins = np.linspace(0, max_seconds, max_seconds)
+            runtime_bins = time_bins(max_seconds, bin_size)
 
         ax = axes2d[plot_i]
 
         time_hist = compute_times_rates(time_rates)
 
-        N = len(time_hist['start_time'])
-        line_segments = LineCollection([[[time_hist['start_time'][i], i],
-                                         [time_hist['end_time'][i], i]] for i in range(N)],
+        line_segments = LineCollection(segments(time_hist['start_time'], time_hist['end_time']),
                                        linestyles='solid', color='k', alpha=0.6, linewidth=0.4)
 
         ax.add_collection(line_segments)
 
-        ax.plot(runtime_bins, time_hist['runtime_calls_hist'].sum(axis=0), label='Parallel {} Functions'.format(l), zorder=-1, c=c)
+        ax.plot(runtime_bins, time_hist['runtime_calls'], label='Parallel {} Functions'.format(l), zorder=-1, c=c)
 
         yplot_step = int(np.max([1, total_calls/20]))
         y_ticks = np.arange(total_calls//yplot_step + 2) * yplot_step
@@ -142,7 +135,23 @@ def create_rates_histogram(res_write, res_read, dst):
     fig.savefig(dst)
 
 
-def create_agg_bdwth_plot(res_write, res_read, dst):
+def create_agg_bdwth_plot(res_write, res_read, dst, bin_size=1.0):
+    """
+    Aggregate bandwidth over time, summed from the throughput samples of
+    the workers. Runs without samples assume every worker moved data at
+    its mean mb_rate between its start and end times.
+    """
+
+    def sampled_rates(start_time, results):
+        times, weights = [], []
+        for res in results:
+            samples = np.asarray(res['throughput'])
+            interval = res['sample_interval']
+            times.append(corrected(res, 'start_time') - start_time + (np.arange(len(samples)) + 0.5) * interval)
+            weights.append(samples)
+        edges = np.append(runtime_bins, runtime_bins[-1] + bin_width)
+        mb, unused = np.histogram(np.concatenate(times), bins=edges, weights=np.concatenate(weights) / 1e6)
+        return mb / bin_width
 
     def compute_times_rates(start_time, d):
 
@@ -152,33 +161,28 @@ def create_agg_bdwth_plot(res_write, res_read, dst):
         tr_end_time = x[:, 1] - tzero
         rate = x[:, 2]
 
-        N = len(tr_start_time)
-        runtime_rate_hist = np.zeros((N, len(runtime_bins)))
-
-        for i in range(N):
-            s = tr_start_time[i]
-            e = tr_end_time[i]
-            a, b = np.searchsorted(runtime_bins, [s, e])
-            if b-a > 0:
-                runtime_rate_hist[i, a:b] = rate[i]
-
         return {'start_time': tr_start_time,
                 'end_time': tr_end_time,
                 'rate': rate,
-                'runtime_rate_hist': runtime_rate_hist}
+                'runtime_rate': sweep(runtime_bins, tr_start_time, tr_end_time, rate)}
 
     fig = pylab.figure(figsize=(5, 5))
     ax = fig.add_subplot(1, 1, 1)
     for datum, l, c in [(res_write, 'Aggregate Write Bandwidth', WRITE_COLOR), (res_read, 'Aggregate Read Bandwidth', READ_COLOR)]:
         start_time = datum['start_time']
-        mb_rates = [(res['start_time'], res['end_time'], res['mb_rate']) for res in datum['results']]
+        mb_rates = [(corrected(res, 'start_time'), corrected(res, 'end_time'), res['mb_rate'])
+                    for res in datum['results']]
         max_seconds = int(max([mr[1]-start_time for mr in mb_rates])*1.2)
         max_seconds = 8 * round(max_seconds/8)
-        runtime_bins = np.linspace(0, max_seconds, max_seconds)
+        runtime_bins = time_bins(max_seconds, bin_size)
+        bin_width = runtime_bins[1] - runtime_bins[0] if len(runtime_bins) > 1 else bin_size
 
-        mb_rates_hist = compute_times_rates(start_time, mb_rates)
+        if all('throughput' in res for res in datum['results']):
+            runtime_rate = sampled_rates(start_time, datum['results'])
+        else:
+            runtime_rate = compute_times_rates(start_time, mb_rates)['runtime_rate']
 
-        ax.plot(mb_rates_hist['runtime_rate_hist'].sum(axis=0)/1000, label=l, c=c)
+        ax.plot(runtime_bins, runtime_rate/1000, label=l, c=c)
 
     ax.set_xlabel('Execution Time (sec)')
     ax.set_ylabel("GB/sec")
@@ -191,3 +195,144 @@ def create_agg_bdwth_plot(res_write, res_read, dst):
 
     fig.tight_layout()
     fig.savefig(dst)
+
+
+def create_latency_plot(res_write, res_read, dst):
+    """
+    CDFs of the per-request time to first byte and full request latency,
+    with the p50/p90/p99/p99.9 percentiles marked
+    """
+    percentiles = [50, 90, 99, 99.9]
+
+    fig, axes = pylab.subplots(nrows=1, ncols=2, sharey=True, figsize=(10, 5))
+    has_requests = False
+    for datum, l, c in [(res_write, 'Write', WRITE_COLOR), (res_read, 'Read', READ_COLOR)]:
+        requests = [res['requests'] for res in datum['results'] if len(res.get('requests', ()))]
+        if not requests:
+            continue
+        has_requests = True
+        x = np.concatenate(requests)
+        for ax, latency, title in [(axes[0], x[:, 1] - x[:, 0], 'Time to First Byte'),
+                                   (axes[1], x[:, 2] - x[:, 0], 'Full Request')]:
+            latency = np.sort(latency)
+            ax.plot(latency, np.arange(1, len(latency)+1) / len(latency), label='{} Requests'.format(l), c=c)
+            ax.scatter(np.percentile(latency, percentiles), np.array(percentiles) / 100, c=[c], s=12, zorder=3)
+            ax.set_title(title)
+
+    if not has_requests:
+        logger.info('No per-request timestamps found, skipping latency plot')
+        pylab.close(fig)
+        return
+
+    for ax in axes:
+        ax.set_xscale('log')
+        ax.set_xlabel('Latency (sec)')
+        ax.grid(True, which='both', alpha=0.3)
+        ax.legend(loc='lower right')
+    axes[0].set_ylabel('Fraction of requests')
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
+
+
+def create_ops_histogram(res_ops, dst):
+    """
+    Latency histogram of every operation type measured by the ops
+    command, titled with its aggregate ops/sec
+    """
+    op_types = res_ops['op_types']
+    results = res_ops['results']
+
+    fig, axes = pylab.subplots(nrows=1, ncols=len(op_types), sharey=True, figsize=(3*len(op_types), 3.5), squeeze=False)
+    for plot_i, op in enumerate(op_types):
+        ax = axes[0, plot_i]
+        latencies = np.concatenate([np.empty(0)] + [r[op]['latencies'] for r in results]) * 1000
+        ops_rate = sum(r[op]['ops_rate'] for r in results)
+        if len(latencies) > 0:
+            low = max(latencies.min(), 1e-3)
+            bins = np.logspace(np.log10(low), np.log10(max(latencies.max()*1.1, low*10)), 40)
+            ax.hist(latencies, bins=bins, histtype='bar', ec='black', color='C{}'.format(plot_i), alpha=0.8)
+        ax.set_xscale('log')
+        ax.set_title('{} - {:.0f} ops/sec'.format(op.upper(), ops_rate), fontsize=10)
+        ax.set_xlabel('Latency (ms)')
+        ax.yaxis.grid(True)
+    axes[0, 0].set_ylabel('Total requests')
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
+
+
+def create_ramp_plot(res_ramp, dst):
+    """
+    Aggregate write and read throughput against the number of workers of
+    each ramp step, with the error rate on a secondary axis and the knee
+    of the curve marked
+    """
+    steps = res_ramp['steps']
+    workers = [s['workers'] for s in steps]
+
+    fig = pylab.figure(figsize=(6, 4))
+    ax = fig.add_subplot(1, 1, 1)
+    ax_err = ax.twinx()
+    for op, color in (('write', WRITE_COLOR), ('read', READ_COLOR)):
+        ax.plot(workers, [s[op]['mb_rate'] for s in steps], marker='o', color=color, label=op.capitalize())
+        ax_err.plot(workers, [s[op]['error_rate'] * 100 for s in steps], linestyle='--', color=color, alpha=0.6)
+    if res_ramp.get('knee'):
+        ax.axvline(res_ramp['knee'], color='gray', linestyle=':', label='Knee ({} workers)'.format(res_ramp['knee']))
+
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel('Concurrent workers')
+    ax.set_ylabel('Aggregate throughput (MB/s)')
+    ax_err.set_ylabel('Failed or throttled requests (%)')
+    ax_err.set_ylim(bottom=0)
+    ax.grid(True)
+    ax.legend(loc='upper left')
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
+
+
+def create_inflight_plot(res_inflight, dst):
+    """
+    Mean ops/sec and MB/s per worker against the number of requests each
+    worker keeps in flight, one line per operation
+    """
+    depths = res_inflight['depths']
+    results = res_inflight['results']
+
+    fig, axes = pylab.subplots(nrows=1, ncols=2, figsize=(10, 4))
+    for op, color in (('put', WRITE_COLOR), ('get', READ_COLOR)):
+        if op not in res_inflight['op_types']:
+            continue
+        levels = [[l for r in results for l in r['levels'] if l['op'] == op and l['depth'] == depth]
+                  for depth in depths]
+        for ax, key in ((axes[0], 'ops_rate'), (axes[1], 'mb_rate')):
+            ax.plot(depths, [np.mean([l[key] for l in level]) for level in levels], marker='o', color=color,
+                    label=op.upper())
+
+    for ax, label in ((axes[0], 'Ops/sec per worker'), (axes[1], 'MB/s per worker')):
+        ax.set_xscale('log', base=2)
+        ax.set_xlabel('Requests in flight')
+        ax.set_ylabel(label)
+        ax.set_ylim(bottom=0)
+        ax.grid(True)
+        ax.legend()
+    pool_size = results[0].get('max_pool_connections') if results else None
+    if pool_size:
+        for ax in axes:
+            ax.axvline(pool_size, color='gray', linestyle=':')
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
@@ -0,0 +1,170 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import glob
+import click
+import numpy as np
+import pandas as pd
+
+from common.store import ResultStore, save_results, load_results, result_path
+from common.report import find_runs, run_label, run_kind, report, compare, cost_report
+from common.pricing import load_pricing
+from common.clock import correct_stored_clocks
+
+
+def find_pickles(paths):
+    pickles = []
+    for path in paths:
+        if os.path.isdir(path):
+            pickles.extend(sorted(glob.glob(os.path.join(path, '**', '*.pickle'), recursive=True)))
+        else:
+            pickles.append(path)
+    return pickles
+
+
+def convert(paths, overwrite):
+    """
+    Converts legacy result pickles into columnar runs saved next to them
+    """
+    for pickle_path in find_pickles(paths):
+        dst = pickle_path[:-len('.pickle')]
+        if os.path.exists(dst) and not overwrite:
+            print('Skipping {}: {} already exists'.format(pickle_path, dst))
+            continue
+        res = load_results(pickle_path)
+        save_results(res, dst)
+        print('{} -> {}'.format(pickle_path, dst))
+
+
+def correct_clocks(paths):
+    """
+    Adds clock skew corrected timestamps to the runs found under paths,
+    for the runs saved before the benchmarks corrected them
+    """
+    for path in find_runs(paths):
+        if path.endswith('.pickle'):
+            print('Skipping {}: convert it first'.format(path))
+            continue
+        offsets = correct_stored_clocks(ResultStore(path, 'a'))
+        if offsets is None:
+            print('{}: no host-side timestamps, not corrected'.format(path))
+            continue
+        print('{}: worker offsets median {:.1f} ms, max {:.1f} ms'.format(
+            path, np.median(offsets) * 1000, np.abs(offsets).max() * 1000))
+
+
+def print_report(paths, csv_path=None):
+    rows = report(paths)
+    if not rows:
+        print('No runs found')
+        return
+    df = pd.DataFrame(rows).sort_values(['unit', 'provider', 'workers', 'run'])
+    for unit, group in df.groupby('unit', sort=False):
+        print('Per-worker and aggregate rates in {}:'.format(unit))
+        print(group.drop(columns='unit').to_string(index=False, float_format=lambda x: '{:.2f}'.format(x)))
+        print()
+    if csv_path:
+        df.to_csv(csv_path, index=False)
+
+
+def check_regressions(baseline_path, paths, alpha, min_slowdown):
+    """
+    Compares every run of the same benchmark and operation found under
+    paths against the baseline run. Returns True if any of them is
+    significantly slower.
+    """
+    baseline = load_results(baseline_path)
+    kind = run_kind(baseline, baseline_path)
+    regression = False
+    for path in find_runs(paths):
+        if os.path.realpath(result_path(path)) == os.path.realpath(result_path(baseline_path)):
+            continue
+        try:
+            candidate = load_results(path)
+            if run_kind(candidate, path) != kind:
+                continue
+            cmp = compare(baseline, candidate, alpha, min_slowdown)
+        except ValueError as e:
+            print('Skipping {}: {}'.format(path, e))
+            continue
+        print('{}/{}: median {:.2f} -> {:.2f} {} ({:+.1%}), p = {:.4f}{}'.format(
+            *run_label(path), cmp['baseline_median'], cmp['candidate_median'], cmp['unit'], cmp['change'],
+            cmp['p_value'], ' - REGRESSION' if cmp['regression'] else ''))
+        regression |= cmp['regression']
+    return regression
+
+
+def print_cost_report(paths, pricing_path, memory, backend, storage_backend, csv_path=None):
+    pricing = load_pricing(pricing_path)
+    rows = cost_report(paths, pricing, memory, backend, storage_backend)
+    if not rows:
+        print('No runs found')
+        return
+    columns = ['provider', 'run', 'workers', 'memory', 'gb_seconds', 'put_requests', 'get_requests', 'cost',
+               'gflops_per_dollar', 'gb_per_dollar']
+    df = pd.DataFrame(rows).astype({'gflops_per_dollar': float, 'gb_per_dollar': float})
+    df = df.sort_values(['provider', 'memory', 'workers', 'run'])
+    print('Cost in {} and throughput per dollar:'.format(pricing['currency']))
+    print(df[columns].to_string(index=False, na_rep='-', float_format=lambda x: '{:.6g}'.format(x)))
+    if csv_path:
+        df.to_csv(csv_path, index=False)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('convert')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--overwrite', is_flag=True, help='replace runs that were already converted')
+def convert_command(paths, overwrite):
+    convert(paths, overwrite)
+
+
+@cli.command('clocks')
+@click.argument('paths', nargs=-1, required=True)
+def clocks_command(paths):
+    correct_clocks(paths)
+
+
+@cli.command('report')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--csv', 'csv_path', default=None, help='also save the comparison table as CSV')
+@click.option('--baseline', default=None, help='run to compare the others against, exits with 1 on a regression')
+@click.option('--alpha', default=0.01, help='significance level of the regression test', type=float)
+@click.option('--min_slowdown', default=0.05, help='smallest drop of the median worker rate reported as a regression', type=float)
+def report_command(paths, csv_path, baseline, alpha, min_slowdown):
+    print_report(paths, csv_path)
+    if baseline and check_regressions(baseline, paths, alpha, min_slowdown):
+        sys.exit(1)
+
+
+@cli.command('cost')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--pricing', 'pricing_path', default=None, help='pricing file, pricing.json by default')
+@click.option('--memory', default=1024, help='worker memory in MB of the runs that do not record it', type=int)
+@click.option('--backend', default=None, help='compute backend of the runs that do not record it')
+@click.option('--storage_backend', default=None, help='storage backend of the runs that do not record it')
+@click.option('--csv', 'csv_path', default=None, help='also save the cost table as CSV')
+def cost_command(paths, pricing_path, memory, backend, storage_backend, csv_path):
+    print_cost_report(paths, pricing_path, memory, backend, storage_backend, csv_path)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,74 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import pylab
+import logging
+import numpy as np
+from matplotlib.collections import LineCollection
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.timeline import time_bins, in_flight, segments
+from common.clock import corrected
+
+pylab.switch_backend("Agg")
+logger = logging.getLogger(__name__)
+
+MAP_COLOR = (1.0, 0.4980392156862745, 0.054901960784313725)
+REDUCE_COLOR = (0.12156862745098039, 0.4666666666666667, 0.7058823529411765)
+
+
+def create_stages_plot(res_map, res_reduce, dst, bin_size=0.5):
+    """
+    Timeline of the map and reduce workers of a shuffle, one segment per
+    worker, with the number of workers running at every moment
+    """
+    tzero = res_map['start_time']
+    stages = [(res_map, 'Map', MAP_COLOR), (res_reduce, 'Reduce', REDUCE_COLOR)]
+    if not res_map['results'] and not res_reduce['results']:
+        logger.info('No worker completed the shuffle, skipping stages plot')
+        return
+    max_seconds = max(corrected(r, 'end_time') for res, unused, unused in stages for r in res['results']) - tzero
+    runtime_bins = time_bins(max_seconds * 1.05, bin_size)
+
+    fig, axes = pylab.subplots(nrows=2, ncols=1, sharex=True, figsize=(8, 6))
+    y_offset = 0
+    for res, label, color in stages:
+        start = np.array([corrected(r, 'start_time') for r in res['results']]) - tzero
+        end = np.array([corrected(r, 'end_time') for r in res['results']]) - tzero
+        worker_segments = segments(start, end)
+        worker_segments[:, :, 1] += y_offset
+        axes[0].add_collection(LineCollection(worker_segments, color=color, linewidth=0.8, label=label))
+        axes[1].plot(runtime_bins, in_flight(runtime_bins, start, end), label='{} workers'.format(label), c=color)
+        y_offset += len(start)
+
+    axes[0].set_xlim(0, max_seconds * 1.05)
+    axes[0].set_ylim(-1, y_offset + 1)
+    axes[0].set_ylabel('Worker')
+    axes[0].legend(loc='upper left')
+    axes[1].set_xlabel('Execution Time (sec)')
+    axes[1].set_ylabel('Running workers')
+    axes[1].set_ylim(bottom=0)
+    axes[1].legend(loc='upper right')
+    for ax in axes:
+        ax.grid(True, alpha=0.3)
+
+    dst = os.path.expanduser(dst) if '~' in dst else dst
+
+    fig.tight_layout()
+    fig.savefig(dst)
+    pylab.close(fig)
@@ -0,0 +1,176 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import time
+import uuid
+import click
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.store import save_results, load_results
+from common.collect import RunCollector
+from common.payload import RandomDataGenerator
+from common.local import get_executor, local_options
+from common.clock import corrected
+
+
+def partition_key(run_prefix, mapper, reducer=None):
+    """
+    Key of the partition of mapper for reducer, or of the single coalesced
+    object holding all the partitions of mapper if reducer is None
+    """
+    if reducer is None:
+        return '{}map-{:05d}'.format(run_prefix, mapper)
+    return '{}map-{:05d}/part-{:05d}'.format(run_prefix, mapper, reducer)
+
+
+def shuffle(bucket_name, mappers, reducers, partition_size, coalesce, threads, memory, key_prefix,
+            res_path=None):
+    """
+    All-to-all exchange through object storage. Every mapper generates
+    reducers partitions of partition_size bytes and writes them, as one
+    object each or coalesced in a single object, and every reducer then
+    reads its partition of every mapper (a whole object or a byte range)
+    and combines them. Each worker issues its requests from threads threads.
+    """
+    run_id = uuid.uuid4().hex[:8].upper()
+    run_prefix = '{}shuffle-{}/'.format(key_prefix, run_id)
+
+    def map_worker(mapper, storage):
+        start_time = time.time()
+        data = RandomDataGenerator(partition_size * reducers)
+        gen_end_time = time.time()
+
+        if coalesce:
+            storage.put_object(bucket_name, partition_key(run_prefix, mapper), data)
+            requests = 1
+        else:
+            def put_partition(reducer):
+                storage.put_object(bucket_name, partition_key(run_prefix, mapper, reducer),
+                                   data.part(reducer * partition_size, partition_size))
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(put_partition, range(reducers)))
+            requests = reducers
+        end_time = time.time()
+
+        return {'start_time': start_time, 'end_time': end_time,
+                'gen_time': gen_end_time - start_time, 'write_time': end_time - gen_end_time,
+                'requests': requests, 'bytes': partition_size * reducers,
+                'mb_rate': partition_size * reducers / (end_time - gen_end_time) / 1e6}
+
+    def reduce_worker(reducer, storage):
+        first_byte = reducer * partition_size
+        last_byte = first_byte + partition_size - 1
+
+        def get_partition(mapper):
+            if coalesce:
+                return storage.get_object(bucket_name, partition_key(run_prefix, mapper),
+                                          extra_get_args={'Range': 'bytes={}-{}'.format(first_byte, last_byte)})
+            return storage.get_object(bucket_name, partition_key(run_prefix, mapper, reducer))
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            partitions = list(pool.map(get_partition, range(mappers)))
+        read_end_time = time.time()
+        # combine: a byte-wise sum over all the partitions received
+        combined = np.zeros(partition_size, dtype=np.uint64)
+        for p in partitions:
+            combined += np.frombuffer(p, dtype=np.uint8)
+        end_time = time.time()
+
+        bytes_read = sum(len(p) for p in partitions)
+        return {'start_time': start_time, 'end_time': end_time,
+                'read_time': read_end_time - start_time, 'combine_time': end_time - read_end_time,
+                'requests': mappers, 'bytes': bytes_read, 'checksum': int(combined.sum()),
+                'mb_rate': bytes_read / (read_end_time - start_time) / 1e6}
+
+    meta = {'bucket_name': bucket_name,
+            'mappers': mappers,
+            'reducers': reducers,
+            'partition_size': partition_size,
+            'coalesce': coalesce,
+            'threads': threads,
+            'memory': memory}
+    exc = get_executor(runtime_memory=memory)
+
+    print('Map stage: {} mappers x {} partitions'.format(mappers, reducers))
+    res_map = RunCollector(res_path and res_path + '_map').map(exc, map_worker, list(range(mappers)), meta=meta,
+                                                               quantity=lambda r: r['bytes'] / 1e6)
+    print('Reduce stage: {} reducers'.format(reducers))
+    res_reduce = RunCollector(res_path and res_path + '_reduce').map(exc, reduce_worker, list(range(reducers)),
+                                                                     meta=meta, quantity=lambda r: r['bytes'] / 1e6)
+
+    print('Deleting temp files...')
+    exc.storage.delete_objects(bucket_name, exc.storage.list_keys(bucket_name, prefix=run_prefix))
+
+    stages = {}
+    for stage, res in [('map', res_map), ('reduce', res_reduce)]:
+        results = res['results']
+        if not results:
+            print('No {} worker completed'.format(stage))
+            stages[stage] = {'time': None, 'requests': 0, 'bytes': 0, 'workers': 0}
+            continue
+        span = max(corrected(r, 'end_time') for r in results) - min(corrected(r, 'start_time') for r in results)
+        stages[stage] = {'time': span,
+                         'requests': int(sum(r['requests'] for r in results)),
+                         'bytes': int(sum(r['bytes'] for r in results)),
+                         'workers': len(results)}
+        print('{:>6} stage: {:.2f} s - {} requests - {:.2f} MB/s aggregate'.format(
+            stage.capitalize(), span, stages[stage]['requests'], stages[stage]['bytes'] / span / 1e6))
+    total_time = None
+    if res_map['results'] and res_reduce['results']:
+        total_time = max(corrected(r, 'end_time') for r in res_reduce['results']) - \
+            min(corrected(r, 'start_time') for r in res_map['results'])
+        print('Shuffle: {:.2f} MB in {:.2f} s - {:.2f} MB/s end to end'.format(
+            stages['map']['bytes'] / 1e6, total_time, stages['map']['bytes'] / total_time / 1e6))
+
+    res = dict(meta, stages=stages, shuffle_time=total_time)
+    if res_path:
+        save_results(res, res_path)
+    return res, res_map, res_reduce
+
+
+@click.command()
+@click.option('--bucket_name', help='bucket to save the intermediate data in')
+@click.option('--mappers', default=10, help='number of map workers', type=int)
+@click.option('--reducers', default=10, help='number of reduce workers', type=int)
+@click.option('--partition_kb', default=1024, help='KB of each partition sent from a mapper to a reducer', type=int)
+@click.option('--coalesce', is_flag=True, help='write the partitions of each mapper as a single object')
+@click.option('--threads', default=8, help='number of concurrent requests within each worker', type=int)
+@click.option('--memory', default=1024, help='Memory per worker in MB', type=int)
+@click.option('--key_prefix', default='', help='Object key prefix')
+@click.option('--outdir', default='.', help='dir to save results in')
+@click.option('--name', default='shuffle_benchmark', help='filename to save results in')
+@local_options
+def run_benchmark(bucket_name, mappers, reducers, partition_kb, coalesce, threads, memory, key_prefix, outdir, name):
+    if bucket_name is None:
+        raise ValueError('You must provide a bucket name within --bucket_name parameter')
+    if True:
+        res, res_map, res_reduce = shuffle(bucket_name, mappers, reducers, partition_kb * 1024, coalesce, threads,
+                                           memory, key_prefix, '{}/{}'.format(outdir, name))
+    else:
+        res = load_results('{}/{}'.format(outdir, name))
+        res_map = load_results('{}/{}_map'.format(outdir, name))
+        res_reduce = load_results('{}/{}_reduce'.format(outdir, name))
+    from plots import create_stages_plot
+    create_stages_plot(res_map, res_reduce, '{}/{}_stages.png'.format(outdir, name))
+
+
+if __name__ == "__main__":
+    run_benchmark()
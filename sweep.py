@@ -0,0 +1,265 @@
+#
+# Copyright Cloudlab URV 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import importlib
+import click
+import numpy as np
+import pandas as pd
+
+from common.store import load_results
+from common.report import summarize
+from common.pricing import load_pricing, run_cost
+from common.local import get_executor, local_options
+
+INDEX = 'index.json'
+
+# directory and module of every benchmark
+BENCHMARKS = {'flops': ('flops', 'flops_benchmark'),
+              'storage': ('object_storage', 'os_benchmark')}
+
+DEFAULTS = {'flops': {'workers': 10, 'memory': 1024, 'matn': 1024, 'loopcount': 6, 'dtype': 'float64',
+                      'kernel': 'gemm', 'blas_threads': 0, 'stream_mb': 64},
+            'storage': {'bucket_name': None, 'number': 10, 'memory': 1024, 'mb_per_file': 64, 'read_times': 1,
+                        'retries': 0, 'key_prefix': ''}}
+
+
+def load_benchmark(benchmark):
+    """
+    Imports the module of a benchmark. Only one benchmark is loaded per
+    process, as each of them imports its own plots module.
+    """
+    directory, module = BENCHMARKS[benchmark]
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), directory))
+    return importlib.import_module(module)
+
+
+def load_spec(path):
+    """
+    Sweep spec from a YAML (or JSON) file: benchmark, params (a value or
+    a list of values per parameter), repeats and seed
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError('PyYAML is needed to read sweep specs, install it with: pip install pyyaml')
+    with open(os.path.expanduser(path)) as f:
+        return yaml.safe_load(f)
+
+
+def parse_param(param):
+    """
+    'name=v1,v2' grid option into name and its list of values
+    """
+    name, values = param.split('=', 1)
+
+    def parse_value(value):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    return name.strip(), [parse_value(v.strip()) for v in values.split(',')]
+
+
+def grid_points(params):
+    """
+    Every combination of the parameter values, in the order given
+    """
+    names = list(params)
+    values = [v if isinstance(v, list) else [v] for v in params.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def plan(points, repeats, seed):
+    """
+    Runs of the sweep, every point repeated repeats times, in random order
+    so that no configuration is always measured at the same time of day
+    """
+    runs = [{'point': i, 'repeat': r, 'params': p} for i, p in enumerate(points) for r in range(repeats)]
+    random.Random(seed).shuffle(runs)
+    for i, run in enumerate(runs):
+        run['run'] = i
+    return runs
+
+
+def run_flops(module, exc, params, path):
+    matns = params['matn'] if isinstance(params['matn'], list) else [params['matn']]
+    module.benchmark(params['workers'], params['memory'], params['loopcount'], matns, [params['dtype']],
+                     [params['kernel']], params['blas_threads'], params['stream_mb'], path, exc=exc)
+    return {'flops': path}
+
+
+def run_storage(module, exc, params, path):
+    if params['bucket_name'] is None:
+        raise ValueError('The storage sweep needs a bucket_name parameter')
+    res_write = module.write(params['bucket_name'], params['mb_per_file'], params['number'], params['key_prefix'],
+                             res_path=path + '_write', retries=params['retries'], memory=params['memory'], exc=exc)
+    try:
+        module.read(params['bucket_name'], params['number'], res_write['keynames'], params['read_times'],
+                    res_path=path + '_read', retries=params['retries'], memory=params['memory'], exc=exc)
+    finally:
+        module.delete_temp_data(params['bucket_name'], res_write['keynames'], exc)
+    return {'write': path + '_write', 'read': path + '_read'}
+
+
+RUNNERS = {'flops': run_flops, 'storage': run_storage}
+
+
+def run_summary(path, pricing):
+    """
+    Median and mean aggregate rate and cost of a finished run
+    """
+    res = load_results(path)
+    summary = summarize(res) or {}
+    row = {'path': os.path.basename(path),
+           'unit': summary.get('unit'),
+           'p50': summary.get('p50'),
+           'mean_aggregate': summary.get('mean_aggregate'),
+           'total_time': res['total_time']}
+    cost = run_cost(res, pricing)
+    if cost is not None:
+        row.update({k: cost[k] for k in ['cost', 'gflops_per_dollar', 'gb_per_dollar']})
+    return {k: float(v) if isinstance(v, (np.floating, np.integer)) else v for k, v in row.items()}
+
+
+def save_index(index, outdir):
+    tmp_path = os.path.join(outdir, INDEX + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(outdir, INDEX))
+
+
+def sweep(spec, outdir, resume=False):
+    """
+    Runs every point of the spec grid repeats times in random order. The
+    executors are created once per memory tier and reused by all the runs
+    of that tier. Runs are saved in outdir as p{point}_r{repeat} and
+    listed, with their parameters and summary, in outdir/index.json,
+    which is rewritten after every run. With resume=True the runs of an
+    existing index that did not finish are executed again.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    if resume and os.path.exists(os.path.join(outdir, INDEX)):
+        with open(os.path.join(outdir, INDEX)) as f:
+            index = json.load(f)
+        print('Resuming {}: {}/{} runs already done'.format(
+            outdir, sum(r.get('status') == 'done' for r in index['runs']), len(index['runs'])))
+    else:
+        points = grid_points(spec['params'])
+        index = {'spec': spec, 'points': points, 'runs': plan(points, spec['repeats'], spec['seed'])}
+        save_index(index, outdir)
+
+    benchmark = index['spec']['benchmark']
+    module = load_benchmark(benchmark)
+    pricing = load_pricing()
+    executors = {}
+
+    for run in index['runs']:
+        if run.get('status') == 'done':
+            continue
+        params = dict(DEFAULTS[benchmark], **run['params'])
+        if params['memory'] not in executors:
+            executors[params['memory']] = get_executor(runtime_memory=params['memory'])
+        name = 'p{:03d}_r{}'.format(run['point'], run['repeat'])
+        print('Sweep run {}/{} - {}: {}'.format(run['run'] + 1, len(index['runs']), name, run['params']))
+
+        run['start_time'] = time.time()
+        try:
+            paths = RUNNERS[benchmark](module, executors[params['memory']], params, os.path.join(outdir, name))
+            run['results'] = {stage: run_summary(path, pricing) for stage, path in paths.items()}
+            run['status'] = 'done'
+            run.pop('error', None)
+        except Exception as e:
+            print('Sweep run {} failed: {}'.format(name, e))
+            run['status'] = 'failed'
+            run['error'] = str(e)
+        run['total_time'] = time.time() - run['start_time']
+        save_index(index, outdir)
+
+    return index
+
+
+def sweep_table(index):
+    """
+    Median over the repeats of every point and run result of a sweep
+    """
+    rows = []
+    for run in index['runs']:
+        params = {k: tuple(v) if isinstance(v, list) else v for k, v in run['params'].items()}
+        for stage, result in run.get('results', {}).items():
+            rows.append(dict(params, point=run['point'], stage=stage, **result))
+    if not rows:
+        return None
+    df = pd.DataFrame(rows)
+    keys = ['point'] + list(index['points'][0]) + ['stage', 'unit']
+    df = df.astype({c: float for c in df.columns if c.endswith('_per_dollar') or c == 'cost'})
+    table = df.groupby(keys, sort=True, dropna=False).median(numeric_only=True)
+    table['repeats'] = df.groupby(keys, sort=True, dropna=False).size()
+    return table.reset_index()
+
+
+def print_sweep(index):
+    table = sweep_table(index)
+    if table is None:
+        print('No finished runs')
+        return
+    failed = sum(r.get('status') == 'failed' for r in index['runs'])
+    print('Median over the repeats of every point{}:'.format(
+        ' ({} runs failed, run again with --resume)'.format(failed) if failed else ''))
+    print(table.to_string(index=False, na_rep='-', float_format=lambda x: '{:.4g}'.format(x)))
+
+
+@click.command()
+@click.option('--spec', 'spec_path', default=None, help='YAML file with benchmark, params, repeats and seed')
+@click.option('--benchmark', default=None, type=click.Choice(BENCHMARKS), help='benchmark to sweep')
+@click.option('--param', 'params', multiple=True, help='grid of a parameter as name=value1,value2, can be repeated')
+@click.option('--repeats', default=None, help='times every point is run (default 1)', type=int)
+@click.option('--seed', default=None, help='seed of the random run order (default 0)', type=int)
+@click.option('--outdir', default='sweep', help='dir to save the runs and their index in')
+@click.option('--resume', is_flag=True, help='only run the points missing from a previous, interrupted sweep')
+@local_options
+def run_sweep(spec_path, benchmark, params, repeats, seed, outdir, resume):
+    outdir = os.path.expanduser(outdir)
+    if resume and os.path.exists(os.path.join(outdir, INDEX)):
+        # the spec of the interrupted sweep is kept in its index
+        print_sweep(sweep(None, outdir, resume))
+        return
+
+    spec = load_spec(spec_path) if spec_path else {}
+    spec.setdefault('params', {})
+    spec['params'].update(parse_param(p) for p in params)
+    if benchmark:
+        spec['benchmark'] = benchmark
+    spec['repeats'] = repeats or spec.get('repeats', 1)
+    spec['seed'] = spec.get('seed', 0) if seed is None else seed
+    if spec.get('benchmark') not in BENCHMARKS:
+        raise ValueError('Choose the benchmark with --benchmark or in the spec: {}'.format(', '.join(BENCHMARKS)))
+    unknown = set(spec['params']) - set(DEFAULTS[spec['benchmark']])
+    if unknown:
+        raise ValueError('Unknown {} parameters: {}'.format(spec['benchmark'], ', '.join(sorted(unknown))))
+
+    index = sweep(spec, outdir, resume)
+    print_sweep(index)
+
+
+if __name__ == '__main__':
+    run_sweep()